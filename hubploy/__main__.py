@@ -4,12 +4,19 @@ import logging
 import os
 import sys
 
-from hubploy import helm
+from hubploy import helm, inventory, preview, releases, rollback
 from argparse import RawTextHelpFormatter
 
 logging.basicConfig(stream=sys.stdout, level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+SELECTOR_HELP = (
+    "{verb} the deployments that match this selector, of those given or else "
+    + "of all deployments (e.g. provider=gcloud,tier!=small). The keys name, "
+    + "provider and cluster match those attributes, any other key the labels "
+    + "in hubploy.yaml."
+)
+
 
 def main():
     argparser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
@@ -38,7 +45,9 @@ def main():
         "deploy", help="Deploy a chart to the given environment."
     )
 
-    deploy_parser.add_argument("deployment", help="The name of the hub to deploy.")
+    deploy_parser.add_argument(
+        "deployment", nargs="*", help="The name of the hub(s) to deploy."
+    )
     deploy_parser.add_argument("chart", help="The path to the main hub chart.")
     deploy_parser.add_argument(
         "environment",
@@ -104,6 +113,263 @@ def main():
         + "the script will exit. To enable this option, set a local environment "
         + "variable HUBPLOY_LOCAL_DEBUG=true",
     )
+    deploy_parser.add_argument(
+        "--sops-cache",
+        action="store_true",
+        help="Keep decrypted secrets for the run, so a secrets file whose "
+        + "encrypted contents are identical to one already decrypted (e.g. "
+        + "shared by several deployments) is not decrypted again. Every "
+        + "distinct secrets file is still decrypted once.",
+    )
+    deploy_parser.add_argument(
+        "--skip-probes",
+        action="store_true",
+        help="Do not run the post-deploy smoke probes configured in hubploy.yaml.",
+    )
+    deploy_parser.add_argument(
+        "--merge-values",
+        action="store_true",
+        help="Merge the config files, secret files and --set values into one "
+        + "values document in-process and pass it to helm over stdin. Its "
+        + "digest is logged, and with --debug the redacted values too.",
+    )
+    deploy_parser.add_argument(
+        "--helm-output-tail",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Do not write helm output to the terminal; if helm fails, print "
+        + "only its last N lines.",
+    )
+    deploy_parser.add_argument(
+        "--helm-log-dir",
+        default=None,
+        help="Write the (redacted) helm output of each deployment to a gzip "
+        + "compressed log file in this directory.",
+    )
+    deploy_parser.add_argument(
+        "--selector",
+        "-l",
+        default=None,
+        help=SELECTOR_HELP.format(verb="Deploy"),
+    )
+    deploy_parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="Record the status and input digest of each deployment in this "
+        + "file as the run progresses.",
+    )
+    deploy_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip deployments that the --checkpoint file records as already "
+        + "deployed with the same inputs.",
+    )
+    deploy_parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        help="Number of times to retry a deployment after a transient helm or "
+        + "Kubernetes API failure. Defaults to 0.",
+    )
+    deploy_parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=10,
+        help="Seconds to wait before the first retry, doubled for each "
+        + "following retry. Defaults to 10 seconds.",
+    )
+
+    rollback_parser = subparsers.add_parser(
+        "rollback",
+        help="Roll back a deployed hub to an earlier helm revision, without "
+        + "decrypting secrets or resolving chart dependencies.",
+    )
+    rollback_parser.add_argument(
+        "deployment", nargs="*", help="The name of the hub(s) to roll back."
+    )
+    rollback_parser.add_argument(
+        "environment",
+        choices=["develop", "staging", "prod"],
+        help="The environment to roll back.",
+    )
+    rollback_parser.add_argument(
+        "--namespace",
+        default=None,
+        help="Helm option: the namespace of the release. If not specified, "
+        + "the namespace will be derived from the environment argument.",
+    )
+    rollback_target = rollback_parser.add_mutually_exclusive_group()
+    rollback_target.add_argument(
+        "--to-revision",
+        type=int,
+        default=None,
+        help="The helm revision to roll back to. Defaults to the previous "
+        + "revision.",
+    )
+    rollback_target.add_argument(
+        "--to-digest",
+        default=None,
+        help="Roll back to the newest revision deployed from inputs with this "
+        + "digest (or a unique prefix of it).",
+    )
+    rollback_parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Helm option: wait until the rolled back resources are ready.",
+    )
+    rollback_parser.add_argument(
+        "--timeout",
+        help="Helm option: time to wait for any individual Kubernetes "
+        + "operation. Defaults to 300 seconds.",
+    )
+    rollback_parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        help="Number of hubs to roll back concurrently. Defaults to 1.",
+    )
+    rollback_parser.add_argument(
+        "--selector",
+        "-l",
+        default=None,
+        help=SELECTOR_HELP.format(verb="Roll back"),
+    )
+    rollback_parser.set_defaults(dry_run=False)
+
+    releases_parser = subparsers.add_parser(
+        "releases",
+        help="Report on or prune the helm release history stored in the "
+        + "cluster for the given deployments.",
+    )
+    releases_parser.add_argument(
+        "action",
+        choices=["report", "prune"],
+        help="Report the number and size of stored revisions, or delete all "
+        + "but the newest ones.",
+    )
+    releases_parser.add_argument(
+        "deployment", nargs="*", help="The name of the hub(s) to inspect."
+    )
+    releases_parser.add_argument(
+        "environment",
+        choices=["develop", "staging", "prod"],
+        help="The environment of the releases.",
+    )
+    releases_parser.add_argument(
+        "--namespace",
+        default=None,
+        help="Helm option: the namespace of the release. If not specified, "
+        + "the namespace will be derived from the environment argument.",
+    )
+    releases_parser.add_argument(
+        "--keep",
+        type=int,
+        default=None,
+        help="Number of revisions to keep when pruning; 0 keeps them all. "
+        + "Defaults to helm.history_max in hubploy.yaml, or 10.",
+    )
+    releases_parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        help="Number of hubs to process concurrently. Defaults to 1.",
+    )
+    releases_parser.add_argument(
+        "--dry-run",
+        dest="prune_dry_run",
+        action="store_true",
+        help="Report what would be pruned without deleting anything.",
+    )
+    releases_parser.add_argument(
+        "--selector",
+        "-l",
+        default=None,
+        help=SELECTOR_HELP.format(verb="Process"),
+    )
+    releases_parser.set_defaults(dry_run=False)
+
+    preview_parser = subparsers.add_parser(
+        "preview",
+        help="Manage throwaway preview deployments of a hub for pull requests.",
+    )
+    preview_subparsers = preview_parser.add_subparsers(
+        dest="preview_command", required=True
+    )
+    preview_up_parser = preview_subparsers.add_parser(
+        "up",
+        help="Deploy or update the develop config of a hub as a preview for a "
+        + "pull request.",
+    )
+    preview_up_parser.add_argument("deployment", help="The name of the hub.")
+    preview_up_parser.add_argument("chart", help="The path to the main hub chart.")
+    preview_up_parser.add_argument("pr", help="The pull request number.")
+    preview_up_parser.add_argument(
+        "--ttl",
+        type=float,
+        default=preview.DEFAULT_TTL_HOURS,
+        help="Hours after which the preview may be garbage collected. "
+        + f"Defaults to {preview.DEFAULT_TTL_HOURS}.",
+    )
+    preview_up_parser.add_argument(
+        "--secrets-cache",
+        default=None,
+        help="Keep decrypted secrets in this directory and reuse them while "
+        + "their encrypted contents are unchanged. The directory holds plain "
+        + "text secrets, so only use this on a trusted machine.",
+    )
+    preview_up_parser.add_argument(
+        "--set",
+        action="append",
+        help="Helm option:  set values on the command line (can specify "
+        + "multiple or separate values with commas: key1=val1,key2=val2)",
+    )
+    preview_up_parser.add_argument(
+        "--set-string",
+        action="append",
+        help="Helm option: set STRING values on the command line (can "
+        + "specify multiple or separate values with commas: key1=val1,key2=val2)",
+    )
+    preview_up_parser.add_argument(
+        "--timeout",
+        help="Helm option: time in seconds to wait for any individual "
+        + "Kubernetes operation (like Jobs for hooks, etc).  Defaults to 300 "
+        + "seconds.",
+    )
+    preview_down_parser = preview_subparsers.add_parser(
+        "down", help="Delete the preview of a hub for a pull request."
+    )
+    preview_down_parser.add_argument("deployment", help="The name of the hub.")
+    preview_down_parser.add_argument("pr", help="The pull request number.")
+    preview_gc_parser = preview_subparsers.add_parser(
+        "gc", help="Delete all expired previews."
+    )
+    preview_gc_parser.add_argument(
+        "deployment",
+        nargs="*",
+        help="The name of the hub(s) whose previews to collect. Defaults to "
+        + "all deployments.",
+    )
+    preview_gc_parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        help="Number of hubs to process concurrently. Defaults to 1.",
+    )
+    preview_gc_parser.add_argument(
+        "--dry-run",
+        dest="gc_dry_run",
+        action="store_true",
+        help="List the expired previews without deleting them.",
+    )
+    preview_gc_parser.add_argument(
+        "--selector",
+        "-l",
+        default=None,
+        help=SELECTOR_HELP.format(verb="Collect the previews of"),
+    )
+    preview_parser.set_defaults(dry_run=False)
+
     args = argparser.parse_args()
 
     if args.command is None:
@@ -137,33 +403,155 @@ def main():
                 print("Exiting...")
                 sys.exit(1)
 
+    if args.command == "deploy" and args.resume and not args.checkpoint:
+        deploy_parser.error("--resume requires --checkpoint")
+
+    command_parser = {
+        "deploy": deploy_parser,
+        "rollback": rollback_parser,
+        "releases": releases_parser,
+    }.get(args.command)
+    if getattr(args, "selector", None):
+        try:
+            args.deployment = inventory.select(args.selector, args.deployment)
+        except (
+            inventory.SelectorParseError,
+            hubploy.config.DeploymentNotFoundError,
+        ) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        if not args.deployment:
+            print(f"No deployments match selector {args.selector}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Selected deployments: {', '.join(args.deployment)}")
+    elif command_parser is not None and not args.deployment:
+        command_parser.error("give at least one deployment, or --selector")
+
+    # Every hub would otherwise be deployed into the same namespace
+    if command_parser is not None and args.namespace and len(args.deployment) > 1:
+        command_parser.error("--namespace can only be used with a single deployment")
+
+    if args.command == "releases" and args.keep is not None and args.keep < 0:
+        releases_parser.error("--keep must be 0 or more")
+
+    if args.command == "rollback" and len(args.deployment) > 1:
+        if args.to_revision or args.to_digest:
+            rollback_parser.error(
+                "--to-revision and --to-digest can only be used with a single "
+                + "deployment"
+            )
+
+    if args.command == "preview" and args.preview_command != "gc":
+        # The pull request number ends up in release names and label values
+        try:
+            preview.preview_name(args.deployment, args.pr)
+        except ValueError as e:
+            preview_parser.error(str(e))
+
+    if args.command == "preview" and args.preview_command == "gc":
+        if not args.deployment:
+            # The inventory skips directories without a hubploy.yaml
+            args.deployment = sorted(inventory.load_inventory())
+    deployments = args.deployment
+    if isinstance(deployments, str):
+        deployments = [deployments]
+
     # Attempt to load the config early, fail if it doesn't exist or is invalid
     try:
-        config = hubploy.config.get_config(args.deployment, debug=False, verbose=False)
-        if not config:
-            raise hubploy.config.DeploymentNotFoundError(
-                "Deployment '{}' not found in hubploy.yaml".format(args.deployment)
-            )
+        for deployment in deployments:
+            config = hubploy.config.get_config(deployment, debug=False, verbose=False)
+            if not config:
+                raise hubploy.config.DeploymentNotFoundError(
+                    "Deployment '{}' not found in hubploy.yaml".format(deployment)
+                )
     except hubploy.config.DeploymentNotFoundError as e:
         print(e, file=sys.stderr)
         sys.exit(1)
 
-    helm.deploy(
+    if args.command == "preview":
+        if args.preview_command == "up":
+            try:
+                preview.up(
+                    args.deployment,
+                    args.chart,
+                    args.pr,
+                    ttl_hours=args.ttl,
+                    secrets_cache=args.secrets_cache,
+                    helm_config_overrides_implicit=args.set,
+                    helm_config_overrides_string=args.set_string,
+                    timeout=args.timeout,
+                    debug=args.debug,
+                    verbose=args.verbose,
+                )
+            except preview.PreviewConflictError as e:
+                print(e, file=sys.stderr)
+                sys.exit(1)
+        elif args.preview_command == "down":
+            preview.down(args.deployment, args.pr, args.debug, args.verbose)
+        else:
+            preview.gc_many(
+                args.deployment,
+                parallel=args.parallel,
+                dry_run=args.gc_dry_run,
+                debug=args.debug,
+                verbose=args.verbose,
+            )
+        return
+
+    if args.command == "releases":
+        releases.releases_many(
+            args.deployment,
+            args.environment,
+            args.action,
+            parallel=args.parallel,
+            namespace=args.namespace,
+            keep=args.keep,
+            dry_run=args.prune_dry_run,
+            debug=args.debug,
+            verbose=args.verbose,
+        )
+        return
+
+    if args.command == "rollback":
+        rollback.rollback_many(
+            args.deployment,
+            args.environment,
+            parallel=args.parallel,
+            namespace=args.namespace,
+            revision=args.to_revision,
+            digest=args.to_digest,
+            wait=args.wait,
+            timeout=args.timeout,
+            debug=args.debug,
+            verbose=args.verbose,
+        )
+        return
+
+    helm.deploy_many(
         args.deployment,
         args.chart,
         args.environment,
-        args.namespace,
-        args.set,
-        args.set_string,
-        args.version,
-        args.timeout,
-        args.force,
-        args.atomic,
-        args.cleanup_on_fail,
-        args.debug,
-        args.verbose,
-        args.helm_debug,
-        args.dry_run,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        namespace=args.namespace,
+        helm_config_overrides_implicit=args.set,
+        helm_config_overrides_string=args.set_string,
+        version=args.version,
+        timeout=args.timeout,
+        force=args.force,
+        atomic=args.atomic,
+        cleanup_on_fail=args.cleanup_on_fail,
+        debug=args.debug,
+        verbose=args.verbose,
+        helm_debug=args.helm_debug,
+        dry_run=args.dry_run,
+        use_sops_cache=args.sops_cache,
+        skip_probes=args.skip_probes,
+        merge_values=args.merge_values,
+        helm_output_tail=args.helm_output_tail,
+        helm_log_dir=args.helm_log_dir,
     )
 
 
@@ -0,0 +1,150 @@
+"""
+A programmatic interface to hubploy deploys, for driving many deploys from one
+long-lived Python process instead of running `hubploy` once per hub.
+
+    from hubploy.api import DeployRequest, deploy
+
+    result = deploy(DeployRequest("my-hub", "hub", "staging"))
+    if result.status != "deployed":
+        print(result.error, result.output)
+
+deploy() never raises for a failed deploy; the failure is described by the
+returned DeployResult. deploy_async() runs a deploy in a worker process, since
+cluster authentication changes process wide state such as KUBECONFIG and so
+concurrent deploys cannot share a process.
+"""
+
+import asyncio
+import logging
+import subprocess
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from hubploy import helm
+
+logger = logging.getLogger(__name__)
+
+STATUS_DEPLOYED = "deployed"
+STATUS_FAILED = "failed"
+DEFAULT_ASYNC_WORKERS = 4
+
+_executor = None
+
+
+@dataclass
+class DeployRequest:
+    """
+    The arguments of a deploy, as taken by `hubploy deploy`.
+    """
+
+    deployment: str
+    chart: str
+    environment: str
+    namespace: str | None = None
+    helm_config_overrides_implicit: list[str] = field(default_factory=list)
+    helm_config_overrides_string: list[str] = field(default_factory=list)
+    version: str | None = None
+    timeout: str | None = None
+    force: bool = False
+    atomic: bool = False
+    cleanup_on_fail: bool = False
+    dry_run: bool = False
+    use_sops_cache: bool = False
+    skip_probes: bool = False
+    merge_values: bool = False
+    helm_output_tail: int | None = None
+    helm_log_dir: str | None = None
+    debug: bool = False
+    verbose: bool = False
+
+
+@dataclass
+class DeployResult:
+    """
+    The outcome of a deploy.
+
+    status is "deployed" or "failed". phases maps each phase of the deploy that
+    was started (decrypt, values, auth, dependencies, namespace, upgrade,
+    probes) to its duration in seconds. revision is the deployed helm revision,
+    and output holds the last lines of helm output (helm_output_tail of them,
+    or output.DEFAULT_TAIL_LINES), with secrets redacted. values_digest is only
+    set for requests with merge_values.
+    """
+
+    request: DeployRequest
+    status: str
+    name: str | None = None
+    namespace: str | None = None
+    input_digest: str | None = None
+    values_digest: str | None = None
+    revision: int | None = None
+    phases: dict[str, float] = field(default_factory=dict)
+    output: str = ""
+    error: str | None = None
+
+
+def deploy(request):
+    """
+    Deploy a JupyterHub as described by request and return a DeployResult.
+    """
+    report = {}
+    error = None
+    try:
+        helm.deploy(
+            request.deployment,
+            request.chart,
+            request.environment,
+            namespace=request.namespace,
+            helm_config_overrides_implicit=request.helm_config_overrides_implicit,
+            helm_config_overrides_string=request.helm_config_overrides_string,
+            version=request.version,
+            timeout=request.timeout,
+            force=request.force,
+            atomic=request.atomic,
+            cleanup_on_fail=request.cleanup_on_fail,
+            debug=request.debug,
+            verbose=request.verbose,
+            dry_run=request.dry_run,
+            use_sops_cache=request.use_sops_cache,
+            skip_probes=request.skip_probes,
+            merge_values=request.merge_values,
+            helm_output_tail=request.helm_output_tail,
+            helm_log_dir=request.helm_log_dir,
+            report=report,
+        )
+    except subprocess.CalledProcessError as e:
+        error = f"{e.cmd[0]} exited with code {e.returncode}"
+    except Exception as e:
+        logger.debug(f"Deploying {request.deployment} failed", exc_info=True)
+        error = repr(e)
+
+    return DeployResult(
+        request=request,
+        status=STATUS_FAILED if error else STATUS_DEPLOYED,
+        name=report.get("name"),
+        namespace=report.get("namespace"),
+        input_digest=report.get("digest"),
+        values_digest=report.get("values_digest"),
+        revision=report.get("revision"),
+        phases=report.get("phases", {}),
+        output=report.get("output", ""),
+        error=error,
+    )
+
+
+async def deploy_async(request, executor=None):
+    """
+    Deploy a JupyterHub in a worker process and return a DeployResult.
+
+    executor must run each call in its own process; by default a shared
+    ProcessPoolExecutor with DEFAULT_ASYNC_WORKERS workers is used, which also
+    bounds how many deploys run at once.
+    """
+    global _executor
+    if executor is None:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=DEFAULT_ASYNC_WORKERS)
+        executor = _executor
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, deploy, request)
@@ -7,17 +7,18 @@ Current cloud providers supported: gcloud, aws, and azure.
 """
 
 import boto3
-import google.auth
+import hashlib
 import json
 import logging
 import os
 import requests
+import shutil
 import subprocess
 import tempfile
 
 from contextlib import contextmanager
 from google.auth.exceptions import DefaultCredentialsError
-from google.auth.transport.requests import Request
+from hubploy import credential
 from hubploy.config import get_config
 from ruamel.yaml import YAML
 from ruamel.yaml.scanner import ScannerError
@@ -26,11 +27,9 @@ logger = logging.getLogger(__name__)
 yaml = YAML(typ="rt")
 
 GKE_API = "https://container.googleapis.com/v1"
-CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
-# Without this scope the token carries no email claim, so GKE resolves the
-# caller to the service account's numeric uniqueId instead of its email and
-# email-based RBAC bindings do not match.
-USERINFO_EMAIL_SCOPE = "https://www.googleapis.com/auth/userinfo.email"
+# Set by sops_cache() to the directory that documents decrypted during the
+# run are kept in.
+SOPS_CACHE_DIR_ENV = "HUBPLOY_SOPS_CACHE_DIR"
 
 
 @contextmanager
@@ -71,15 +70,25 @@ def cluster_auth(deployment, debug=False, verbose=False):
                     os.environ["KUBECONFIG"] = kubeconfig_path
                     yield
             else:
-                # Temporarily kubeconfig file
-                with tempfile.NamedTemporaryFile() as temp_kubeconfig:
+                # Temporarily kubeconfig file, and a private directory for the
+                # tokens its exec credential plugin caches (see credential.py)
+                with (
+                    tempfile.NamedTemporaryFile() as temp_kubeconfig,
+                    tempfile.TemporaryDirectory(
+                        prefix="hubploy-credentials-"
+                    ) as credentials_dir,
+                ):
                     os.environ["KUBECONFIG"] = temp_kubeconfig.name
                     logger.info(f"Attempting to authenticate with {provider}...")
 
                     if provider == "gcloud":
-                        yield from cluster_auth_gcloud(**cluster["gcloud"])
+                        yield from cluster_auth_gcloud(
+                            **cluster["gcloud"], cache_dir=credentials_dir
+                        )
                     elif provider == "aws":
-                        yield from cluster_auth_aws(deployment, **cluster["aws"])
+                        yield from cluster_auth_aws(
+                            deployment, **cluster["aws"], cache_dir=credentials_dir
+                        )
                     elif provider == "azure":
                         yield from cluster_auth_azure(deployment, **cluster["azure"])
                     else:
@@ -90,28 +99,26 @@ def cluster_auth(deployment, debug=False, verbose=False):
             unset_env_var("KUBECONFIG", orig_kubeconfig)
 
 
-def cluster_auth_gcloud(project, cluster, zone):
+def cluster_auth_gcloud(project, cluster, zone, cache_dir):
     """
     Setup GKE authentication with Application Default Credentials
 
     This needs no service account key, never shells out to gcloud, and leaves
     global machine state alone: it mints a token from ADC, reads the
-    cluster's endpoint and CA from the GKE API, and writes the self-contained
-    kubeconfig.
+    cluster's endpoint and CA from the GKE API, and writes a kubeconfig whose
+    user gets tokens from hubploy's exec credential plugin, caching them in
+    cache_dir. Helm and the Kubernetes client so get a fresh token whenever
+    the last one expires, however long the deploy takes.
     """
     try:
-        credentials, adc_project = google.auth.default(
-            scopes=[CLOUD_PLATFORM_SCOPE, USERINFO_EMAIL_SCOPE]
-        )
+        token, expiry = credential.gke_token(cache_dir)
     except DefaultCredentialsError as e:
         raise DefaultCredentialsError(
             "Hubploy found no Application Default Credentials. In CI, "
             "authenticate with workload identity federation first. Locally, run "
             "`gcloud auth application-default login`."
         ) from e
-
-    logger.info(f"Found Application Default Credentials for project {adc_project}")
-    credentials.refresh(Request())
+    logger.info(f"Found Application Default Credentials, token valid until {expiry}")
 
     # A zonal and a regional cluster differ only in the location string, which
     # the GKE API takes either way.
@@ -120,7 +127,7 @@ def cluster_auth_gcloud(project, cluster, zone):
     logger.debug(f"Querying the GKE API: {url}")
     response = requests.get(
         url,
-        headers={"Authorization": f"Bearer {credentials.token}"},
+        headers={"Authorization": f"Bearer {token}"},
         timeout=30,
     )
     try:
@@ -130,32 +137,23 @@ def cluster_auth_gcloud(project, cluster, zone):
         raise
     cluster_info = response.json()
 
-    kubeconfig_path = os.environ.get("KUBECONFIG")
-    if not kubeconfig_path:
-        raise RuntimeError(
-            "KUBECONFIG is not set; cluster_auth_gcloud expects to run "
-            "inside cluster_auth, which creates the temporary kubeconfig."
-        )
-
     context = f"gke_{project}_{zone}_{cluster}"
-    write_gke_kubeconfig(
-        kubeconfig_path,
+    write_kubeconfig(
+        _temporary_kubeconfig_path("cluster_auth_gcloud"),
         context,
-        cluster_info["endpoint"],
+        f"https://{cluster_info['endpoint']}",
         cluster_info["masterAuth"]["clusterCaCertificate"],
-        credentials.token,
+        credential.exec_user(["gke"], cache_dir),
     )
     logger.info(f"Wrote a kubeconfig for context {context}")
 
     yield
 
 
-def write_gke_kubeconfig(path, context, endpoint, ca_cert, token):
+def write_kubeconfig(path, context, server, ca_cert, user):
     """
-    Write a single-context kubeconfig that authenticates with a bearer token
-
-    The token is short lived, and it is the whole credential, so this file is
-    written to the caller's temporary KUBECONFIG and never logged.
+    Write a single-context kubeconfig for server, authenticating as user (a
+    kubeconfig user entry)
     """
     kubeconfig = {
         "apiVersion": "v1",
@@ -165,7 +163,7 @@ def write_gke_kubeconfig(path, context, endpoint, ca_cert, token):
             {
                 "name": context,
                 "cluster": {
-                    "server": f"https://{endpoint}",
+                    "server": server,
                     "certificate-authority-data": ca_cert,
                 },
             }
@@ -176,17 +174,34 @@ def write_gke_kubeconfig(path, context, endpoint, ca_cert, token):
                 "context": {"cluster": context, "user": context},
             }
         ],
-        "users": [{"name": context, "user": {"token": token}}],
+        "users": [{"name": context, "user": user}],
     }
     with open(path, "w") as f:
         yaml.dump(kubeconfig, f)
 
 
+def _temporary_kubeconfig_path(caller):
+    kubeconfig_path = os.environ.get("KUBECONFIG")
+    if not kubeconfig_path:
+        raise RuntimeError(
+            f"KUBECONFIG is not set; {caller} expects to run "
+            "inside cluster_auth, which creates the temporary kubeconfig."
+        )
+    return kubeconfig_path
+
+
 @contextmanager
-def _auth_aws(deployment, service_key=None, role_arn=None, role_session_name=None):
+def _auth_aws(
+    deployment, service_key=None, role_arn=None, role_session_name=None, cache_dir=None
+):
     """
     This helper contextmanager will update AWS_SHARED_CREDENTIALS_FILE if
-    service_key is provided and AWS_SESSION_TOKEN if role_arn is provided.
+    service_key is provided, and provides a boto3 session.
+
+    If role_arn is provided, the environment is left alone: the session's
+    credentials for the role are cached in cache_dir (or a temporary directory)
+    and the role is assumed again whenever they are about to expire, so they
+    never go stale during a long deploy (see credential.aws_role_session).
     """
     # validate arguments
     if bool(service_key) == bool(role_arn):
@@ -223,23 +238,21 @@ def _auth_aws(deployment, service_key=None, role_arn=None, role_session_name=Non
                 ]
             logger.info("Set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
 
-        elif role_arn:
-            original_access_key_id = os.environ.get("AWS_ACCESS_KEY_ID", None)
-            original_secret_access_key = os.environ.get("AWS_SECRET_ACCESS_KEY", None)
-            original_session_token = os.environ.get("AWS_SESSION_TOKEN", None)
-
-            sts_client = boto3.client("sts")
-            assumed_role_object = sts_client.assume_role(
-                RoleArn=role_arn, RoleSessionName=role_session_name
-            )
-
-            creds = assumed_role_object["Credentials"]
-            os.environ["AWS_ACCESS_KEY_ID"] = creds["AccessKeyId"]
-            os.environ["AWS_SECRET_ACCESS_KEY"] = creds["SecretAccessKey"]
-            os.environ["AWS_SESSION_TOKEN"] = creds["SessionToken"]
+            # return until context exits
+            yield boto3.Session()
 
-        # return until context exits
-        yield
+        elif role_arn:
+            if cache_dir:
+                yield credential.aws_role_session(
+                    role_arn, role_session_name, cache_dir
+                )
+            else:
+                with tempfile.TemporaryDirectory(
+                    prefix="hubploy-credentials-"
+                ) as cache_dir:
+                    yield credential.aws_role_session(
+                        role_arn, role_session_name, cache_dir
+                    )
 
     finally:
         if service_key:
@@ -247,29 +260,68 @@ def _auth_aws(deployment, service_key=None, role_arn=None, role_session_name=Non
             unset_env_var("AWS_ACCESS_KEY_ID", original_access_key_id)
             unset_env_var("AWS_SECRET_ACCESS_KEY", original_secret_access_key)
             unset_env_var("AWS_SESSION_TOKEN", original_session_token)
-        elif role_arn:
-            unset_env_var("AWS_ACCESS_KEY_ID", original_access_key_id)
-            unset_env_var("AWS_SECRET_ACCESS_KEY", original_secret_access_key)
-            unset_env_var("AWS_SESSION_TOKEN", original_session_token)
 
 
-def cluster_auth_aws(deployment, cluster, region, service_key=None, role_arn=None):
+def cluster_auth_aws(
+    deployment, cluster, region, service_key=None, role_arn=None, cache_dir=None
+):
     """
     Setup AWS authentication with service_key or with a role
 
-    This changes *global machine state* on what current kubernetes cluster is!
+    With service_key this changes *global machine state* on what current
+    kubernetes cluster is!
+
+    With role_arn, the cluster's endpoint and CA are read from the EKS API and
+    written to a kubeconfig whose user gets tokens from hubploy's exec
+    credential plugin, which assumes the role again (caching its credentials
+    in cache_dir) whenever they are about to expire.
     """
+    role_session_name = "hubploy-cluster-auth"
     with _auth_aws(
         deployment,
         service_key=service_key,
         role_arn=role_arn,
-        role_session_name="hubploy-cluster-auth",
-    ):
-        subprocess.check_call(
-            ["aws", "eks", "update-kubeconfig", "--name", cluster, "--region", region],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
+        role_session_name=role_session_name,
+        cache_dir=cache_dir,
+    ) as session:
+        if role_arn:
+            logger.info(f"Getting credentials for {cluster} in {region}")
+            cluster_info = session.client("eks", region_name=region).describe_cluster(
+                name=cluster
+            )["cluster"]
+            exec_args = [
+                "eks",
+                "--cluster",
+                cluster,
+                "--region",
+                region,
+                "--role-arn",
+                role_arn,
+                "--role-session-name",
+                role_session_name,
+            ]
+            write_kubeconfig(
+                _temporary_kubeconfig_path("cluster_auth_aws"),
+                cluster_info["arn"],
+                cluster_info["endpoint"],
+                cluster_info["certificateAuthority"]["data"],
+                credential.exec_user(exec_args, cache_dir),
+            )
+            logger.info(f"Wrote a kubeconfig for context {cluster_info['arn']}")
+        else:
+            subprocess.check_call(
+                [
+                    "aws",
+                    "eks",
+                    "update-kubeconfig",
+                    "--name",
+                    cluster,
+                    "--region",
+                    region,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.STDOUT,
+            )
         yield
 
 
@@ -387,6 +439,11 @@ def decrypt_file(encrypted_path):
 
     else:
         # If file has a `sops` key, we assume it's sops encrypted
+        cache_dir = os.environ.get(SOPS_CACHE_DIR_ENV)
+        if cache_dir:
+            yield _decrypt_cached(encrypted_path, cache_dir)
+            return
+
         sops_command = ["sops", "--decrypt", encrypted_path]
 
         logger.info("File is sops encrypted, decrypting...")
@@ -400,3 +457,75 @@ def decrypt_file(encrypted_path):
                 ["sops", "--output", f.name, "--decrypt", encrypted_path]
             )
             yield f.name
+
+
+@contextmanager
+def sops_cache(cache_dir=None):
+    """
+    Keep the documents decrypted in this context, and reuse them
+
+    Inside this context, decrypt_file() stores each decrypted document under
+    the digest of its encrypted contents, so a document with identical
+    encrypted contents (for example a secrets file shared by several
+    deployments, or decrypted again on a retry) is only decrypted, and its
+    data key only unwrapped against KMS, GCP KMS or age, once. Every distinct
+    document is still decrypted once.
+
+    By default the documents live in a private temporary directory which is
+    removed on exit. If cache_dir is given, they are kept there instead, and
+    reused by later runs for as long as the encrypted contents are unchanged.
+    The directory then holds plain text secrets after the run, so it must only
+    be used on a machine that is trusted with them.
+    """
+    if os.environ.get(SOPS_CACHE_DIR_ENV):
+        logger.debug("Decrypted documents are already cached, reusing the cache")
+        yield
+        return
+
+    orig_cache_dir = os.environ.get(SOPS_CACHE_DIR_ENV, None)
+    run_dir = None
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    else:
+        run_dir = cache_dir = tempfile.mkdtemp(prefix="hubploy-sops-")
+    try:
+        os.environ[SOPS_CACHE_DIR_ENV] = cache_dir
+        yield
+    finally:
+        unset_env_var(SOPS_CACHE_DIR_ENV, orig_cache_dir)
+        if run_dir:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def _decrypt_cached(encrypted_path, cache_dir):
+    """
+    Decrypt a sops file into the cache_dir set up by sops_cache()
+
+    Decrypted documents are stored in cache_dir under the digest of their
+    encrypted contents, and reused for any later request for the same
+    contents.
+    """
+    with open(encrypted_path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _, ext = os.path.splitext(encrypted_path)
+    decrypted_path = os.path.join(cache_dir, digest + ext)
+
+    if os.path.exists(decrypted_path):
+        logger.info(f"Reusing decrypted contents of {encrypted_path}")
+        return decrypted_path
+
+    # Write to a file of our own next to the final path and rename it, so a
+    # partially written file is never picked up as a cached decryption, and
+    # concurrent runs sharing the cache never write to the same file.
+    fd, partial_path = tempfile.mkstemp(dir=cache_dir, suffix=".partial")
+    os.close(fd)
+    sops_command = ["sops", "--output", partial_path, "--decrypt", encrypted_path]
+    logger.info("File is sops encrypted, decrypting into the cache...")
+    logger.debug("Executing: " + " ".join(sops_command))
+    try:
+        subprocess.check_call(sops_command)
+        os.replace(partial_path, decrypted_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return decrypted_path
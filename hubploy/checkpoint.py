@@ -0,0 +1,88 @@
+"""
+Utils to record the progress of a run over several deployments in a
+checkpoint file (load_checkpoint, record_deployment), so that a failed run can
+be resumed without redeploying the hubs that already succeeded.
+
+The checkpoint file is JSON:
+
+{
+  "deployments": {
+    "deployment-name-environment": {
+      "status": "deployed",
+      "digest": "<input digest>",
+      "attempts": 1,
+      "updated": 1700000000.0
+    }
+  }
+}
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+STATUS_DEPLOYED = "deployed"
+STATUS_FAILED = "failed"
+
+
+def load_checkpoint(path):
+    """
+    Returns the checkpoint stored at path, or an empty checkpoint if the file
+    does not exist yet.
+    """
+    if not os.path.exists(path):
+        logger.info(f"No checkpoint found at {path}, starting a fresh run")
+        return {"deployments": {}}
+
+    logger.info(f"Loading checkpoint from {path}")
+    with open(path) as f:
+        checkpoint = json.load(f)
+    checkpoint.setdefault("deployments", {})
+    return checkpoint
+
+
+def write_checkpoint(path, checkpoint):
+    """
+    Atomically replace the checkpoint file at path
+
+    The checkpoint is written to a temporary file in the same directory and
+    renamed over the old one, so an interrupted run never leaves a truncated
+    checkpoint behind.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, prefix=".hubploy-checkpoint-", delete=False
+    ) as f:
+        json.dump(checkpoint, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, path)
+
+
+def record_deployment(path, checkpoint, name, status, digest, attempts, error=None):
+    """
+    Record the outcome of deploying release name and write the checkpoint.
+    """
+    entry = {
+        "status": status,
+        "digest": digest,
+        "attempts": attempts,
+        "updated": time.time(),
+    }
+    if error is not None:
+        entry["error"] = error
+    checkpoint["deployments"][name] = entry
+    write_checkpoint(path, checkpoint)
+    logger.debug(f"Recorded {name} as {status} in checkpoint {path}")
+
+
+def is_deployed(checkpoint, name, digest):
+    """
+    True if release name was deployed from inputs with the given digest.
+    """
+    entry = checkpoint["deployments"].get(name, {})
+    return entry.get("status") == STATUS_DEPLOYED and entry.get("digest") == digest
@@ -4,6 +4,7 @@ returns it embedded with a set of LocalImage objects with filesystem paths made
 absolute.
 """
 
+import copy
 import logging
 import os
 from ruamel.yaml import YAML
@@ -11,6 +12,10 @@ from ruamel.yaml import YAML
 logger = logging.getLogger(__name__)
 yaml = YAML(typ="safe")
 
+# Parsed hubploy.yaml files, by path, with the mtime and size they were parsed
+# at, so repeated lookups of a deployment in one run do not reparse it.
+_config_cache = {}
+
 
 class DeploymentNotFoundError(Exception):
     def __init__(self, deployment, path, *args, **kwargs):
@@ -74,6 +79,8 @@ def get_config(deployment, debug=False, verbose=False):
     """
     Returns hubploy.yaml configuration as a Python dictionary if it exists for
     a given deployment. This contains the auth and cluster deployment information.
+
+    The parsed file is reused until its modification time or size changes.
     """
     if verbose:
         logger.setLevel(logging.INFO)
@@ -89,7 +96,16 @@ def get_config(deployment, debug=False, verbose=False):
     with open(config_path) as f:
         # If config_path isn't found, this will raise a FileNotFoundError with
         # useful info
-        config = yaml.load(f)
+        stat = os.fstat(f.fileno())
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = _config_cache.get(config_path)
+        if cached is not None and cached[0] == key:
+            logger.debug(f"Reusing parsed config from {config_path}")
+            config = cached[1]
+        else:
+            config = yaml.load(f)
+            _config_cache[config_path] = (key, config)
+            logger.debug(f"Config loaded and parsed: {config}")
 
-    logger.debug(f"Config loaded and parsed: {config}")
-    return config
+    # Callers may modify the config they are given
+    return copy.deepcopy(config)
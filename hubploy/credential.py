@@ -0,0 +1,240 @@
+"""
+A Kubernetes exec credential plugin for the kubeconfigs written by
+auth.cluster_auth, so that helm and the Kubernetes client fetch a fresh token
+whenever the one they hold expires, instead of failing partway through a long
+`helm upgrade --wait` or a batch of deploys.
+
+The kubeconfig's user runs `python -m hubploy.credential gke|eks ...` (see
+exec_user), which prints an ExecCredential with the token and its expiry.
+Tokens, and the assumed role credentials EKS tokens are signed with, are kept
+in a private per-run cache directory until shortly before they expire, so
+every helm invocation does not mint its own.
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+
+import boto3
+import google.auth
+
+from botocore.signers import RequestSigner
+from google.auth.transport.requests import Request
+
+logger = logging.getLogger(__name__)
+
+EXEC_CREDENTIAL_API_VERSION = "client.authentication.k8s.io/v1beta1"
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+# Without this scope the token carries no email claim, so GKE resolves the
+# caller to the service account's numeric uniqueId instead of its email and
+# email-based RBAC bindings do not match.
+USERINFO_EMAIL_SCOPE = "https://www.googleapis.com/auth/userinfo.email"
+# Cached tokens and credentials are refreshed this long before they expire, so
+# one is never handed out just as it is about to stop working.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+# An EKS token is a presigned STS URL valid for 15 minutes; like
+# `aws eks get-token`, report a minute less.
+EKS_TOKEN_LIFETIME = datetime.timedelta(minutes=14)
+# google-auth leaves the expiry unset for tokens whose lifetime it does not
+# know; treat those as valid for less than the usual hour.
+UNKNOWN_TOKEN_LIFETIME = datetime.timedelta(minutes=30)
+EKS_TOKEN_PREFIX = "k8s-aws-v1."
+EKS_CLUSTER_HEADER = "x-k8s-aws-id"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def exec_user(args, cache_dir):
+    """
+    Returns the kubeconfig user entry that runs this plugin with args,
+    caching in cache_dir.
+    """
+    return {
+        "exec": {
+            "apiVersion": EXEC_CREDENTIAL_API_VERSION,
+            "command": sys.executable,
+            "args": ["-m", "hubploy.credential", *args, "--cache-dir", cache_dir],
+            "interactiveMode": "Never",
+        }
+    }
+
+
+def exec_credential(token, expiry):
+    """
+    Returns the ExecCredential document for token, expiring at expiry (a UTC
+    datetime).
+    """
+    return {
+        "apiVersion": EXEC_CREDENTIAL_API_VERSION,
+        "kind": "ExecCredential",
+        "status": {
+            "token": token,
+            "expirationTimestamp": _format_timestamp(expiry),
+        },
+    }
+
+
+def load_cached(cache_dir, key):
+    """
+    Returns the entry cached under key, or None if there is none or it
+    expires within REFRESH_MARGIN.
+    """
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    expiry = _parse_timestamp(entry["expiry"])
+    if expiry - REFRESH_MARGIN <= _utcnow():
+        logger.debug(f"Cached credential {key} expires at {entry['expiry']}")
+        return None
+    return entry
+
+
+def store_cached(cache_dir, key, entry):
+    """
+    Cache entry, which must have an "expiry", under key. The file is only
+    readable by the current user, and replaced atomically, so a concurrent
+    reader never sees it half written.
+    """
+    fd, partial_path = tempfile.mkstemp(dir=cache_dir, suffix=".partial")
+    with os.fdopen(fd, "w") as f:
+        json.dump(entry, f)
+    os.replace(partial_path, os.path.join(cache_dir, f"{key}.json"))
+
+
+def gke_token(cache_dir):
+    """
+    Returns an access token from Application Default Credentials and its
+    expiry, reusing the one cached in cache_dir while it is fresh.
+    """
+    entry = load_cached(cache_dir, "gke")
+    if entry is None:
+        credentials, _ = google.auth.default(
+            scopes=[CLOUD_PLATFORM_SCOPE, USERINFO_EMAIL_SCOPE]
+        )
+        credentials.refresh(Request())
+        if credentials.expiry is None:
+            expiry = _utcnow() + UNKNOWN_TOKEN_LIFETIME
+        else:
+            # google-auth reports expiry as a naive UTC datetime
+            expiry = credentials.expiry.replace(tzinfo=datetime.timezone.utc)
+        logger.info(f"Minted a GKE access token expiring at {expiry}")
+        entry = {"token": credentials.token, "expiry": _format_timestamp(expiry)}
+        store_cached(cache_dir, "gke", entry)
+    return entry["token"], _parse_timestamp(entry["expiry"])
+
+
+def aws_role_session(role_arn, role_session_name, cache_dir):
+    """
+    Returns a boto3 session with credentials for role_arn, assuming the role
+    again with the ambient AWS credentials when the ones cached in cache_dir
+    are about to expire.
+    """
+    role = f"{role_arn}\n{role_session_name}".encode()
+    key = "aws-" + hashlib.sha256(role).hexdigest()[:16]
+    entry = load_cached(cache_dir, key)
+    if entry is None:
+        creds = boto3.client("sts").assume_role(
+            RoleArn=role_arn, RoleSessionName=role_session_name
+        )["Credentials"]
+        logger.info(f"Assumed role {role_arn} until {creds['Expiration']}")
+        entry = {
+            "access_key_id": creds["AccessKeyId"],
+            "secret_access_key": creds["SecretAccessKey"],
+            "session_token": creds["SessionToken"],
+            "expiry": _format_timestamp(creds["Expiration"]),
+        }
+        store_cached(cache_dir, key, entry)
+    return boto3.Session(
+        aws_access_key_id=entry["access_key_id"],
+        aws_secret_access_key=entry["secret_access_key"],
+        aws_session_token=entry["session_token"],
+    )
+
+
+def eks_token(session, cluster, region):
+    """
+    Returns a token for EKS cluster, signed with session's credentials, and
+    its expiry. This is what `aws eks get-token` does: the token is a presigned
+    STS GetCallerIdentity URL, bound to the cluster by a signed header.
+    """
+    sts = session.client("sts", region_name=region)
+    signer = RequestSigner(
+        sts.meta.service_model.service_id,
+        region,
+        "sts",
+        "v4",
+        session.get_credentials(),
+        session.events,
+    )
+    url = signer.generate_presigned_url(
+        {
+            "method": "GET",
+            "url": f"https://sts.{region}.amazonaws.com/"
+            + "?Action=GetCallerIdentity&Version=2011-06-15",
+            "body": {},
+            "headers": {EKS_CLUSTER_HEADER: cluster},
+            "context": {},
+        },
+        region_name=region,
+        expires_in=60,
+        operation_name="",
+    )
+    token = base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+    return EKS_TOKEN_PREFIX + token, _utcnow() + EKS_TOKEN_LIFETIME
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _format_timestamp(value):
+    return value.astimezone(datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _parse_timestamp(value):
+    return datetime.datetime.strptime(value, TIMESTAMP_FORMAT).replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(
+        prog="python -m hubploy.credential",
+        description="Print a Kubernetes ExecCredential for a cluster that "
+        + "hubploy authenticated to.",
+    )
+    subparsers = argparser.add_subparsers(dest="provider", required=True)
+    gke_parser = subparsers.add_parser("gke", help="Token for a GKE cluster.")
+    eks_parser = subparsers.add_parser("eks", help="Token for an EKS cluster.")
+    eks_parser.add_argument("--cluster", required=True)
+    eks_parser.add_argument("--region", required=True)
+    eks_parser.add_argument("--role-arn", default=None)
+    eks_parser.add_argument("--role-session-name", default="hubploy-cluster-auth")
+    for parser in (gke_parser, eks_parser):
+        parser.add_argument("--cache-dir", required=True)
+    args = argparser.parse_args(argv)
+
+    if args.provider == "gke":
+        token, expiry = gke_token(args.cache_dir)
+    else:
+        if args.role_arn:
+            session = aws_role_session(
+                args.role_arn, args.role_session_name, args.cache_dir
+            )
+        else:
+            session = boto3.Session()
+        token, expiry = eks_token(session, args.cluster, args.region)
+
+    json.dump(exec_credential(token, expiry), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
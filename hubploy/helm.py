@@ -15,24 +15,76 @@ deployments/
       - prod.yaml
 
 Util to deploy a Helm chart (deploy) given hubploy configuration and Helm chart
-configuration located in accordance to hubploy conventions.
+configuration located in accordance to hubploy conventions, and to deploy it for
+several deployments in one resumable run (deploy_many).
 """
 
+import hashlib
 import itertools
+import json
 import kubernetes.config
 import logging
 import os
+import re
 import subprocess
+import time
+import urllib3
 
-from contextlib import ExitStack
+from contextlib import ExitStack, contextmanager, nullcontext
 from kubernetes.client import CoreV1Api, rest
 from kubernetes.client.models import V1Namespace, V1ObjectMeta
 
+from hubploy import checkpoint, probe, values
+from hubploy.output import DEFAULT_TAIL_LINES, HelmOutput, secret_strings
 from hubploy.config import get_config, validate_image_configs
-from hubploy.auth import decrypt_file, cluster_auth
+from hubploy.auth import decrypt_file, cluster_auth, sops_cache
 
 logger = logging.getLogger(__name__)
 HELM_EXECUTABLE = os.environ.get("HELM_EXECUTABLE", "helm")
+# Kubernetes API responses that are worth retrying: throttling and server side
+# errors.
+TRANSIENT_API_STATUSES = {429, 500, 502, 503, 504}
+# Helm error messages that show a failure worth retrying: timeouts, dropped
+# connections, throttling and server side errors of the Kubernetes API. Only
+# helm's final "Error:" line is matched, so that a template error mentioning,
+# say, timeoutSeconds is not mistaken for a timeout.
+TRANSIENT_HELM_ERROR = re.compile(
+    r"context deadline exceeded|\btimed out\b|i/o timeout|connection refused"
+    + r"|connection reset by peer|broken pipe|unexpected EOF|too many requests"
+    + r"|\b429\b|internal error occurred|internal server error|bad gateway"
+    + r"|service unavailable|gateway timeout"
+    + r"|the server is currently unable to handle the request",
+    re.IGNORECASE,
+)
+# Where update_dependencies() records the dependency inputs of each chart whose
+# dependencies it has fetched.
+DEPENDENCIES_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "hubploy",
+    "dependencies",
+)
+# Recorded as the helm release description, so that the inputs of every
+# revision can be recovered from `helm history`.
+DESCRIPTION_DIGEST_PREFIX = "hubploy input-digest="
+
+
+def load_kube_config(context):
+    """
+    Load the kubeconfig for context so the kubernetes client can be used,
+    falling back to in-cluster config.
+    """
+    kubeconfig = os.environ.get("KUBECONFIG", None)
+    logger.debug("Loading kubeconfig for k8s access")
+    try:
+        kubernetes.config.load_kube_config(config_file=kubeconfig, context=context)
+        logger.info(f"Loaded kubeconfig {kubeconfig} for context {context}")
+    except Exception as e:
+        logger.info(
+            f"Failed to load kubeconfig {kubeconfig} context {context} with "
+            + f"exception:\n{e}\nTrying in-cluster config..."
+        )
+        kubernetes.config.load_incluster_config()
+        logger.info("Loaded in-cluster kubeconfig")
 
 
 def helm_upgrade(
@@ -52,6 +104,13 @@ def helm_upgrade(
     verbose,
     helm_debug,
     dry_run,
+    description=None,
+    history_max=None,
+    report=None,
+    namespace_labels=None,
+    reuse_dependencies=False,
+    values_document=None,
+    output=None,
 ):
     if verbose:
         logger.setLevel(logging.INFO)
@@ -59,35 +118,35 @@ def helm_upgrade(
         logger.setLevel(logging.DEBUG)
 
     logger.info(f"Deploying {name} in namespace {namespace}")
-    logger.debug(f"Running helm dep up in subdirectory '{chart}'")
-    subprocess.check_call([HELM_EXECUTABLE, "dep", "up"], cwd=chart)
+    with phase(report, "dependencies"):
+        update_dependencies(chart, output, reuse_dependencies)
 
     # Create namespace explicitly, since helm3 removes support for it
     # See https://github.com/helm/helm/issues/6794
     # helm2 only creates the namespace if it doesn't exist, so we should be fine
-    kubeconfig = os.environ.get("KUBECONFIG", None)
-    logger.debug("Loading kubeconfig for k8s access")
-    try:
-        kubernetes.config.load_kube_config(config_file=kubeconfig, context=context)
-        logger.info(f"Loaded kubeconfig {kubeconfig} for context {context}")
-    except Exception as e:
-        logger.info(
-            f"Failed to load kubeconfig {kubeconfig} context {context} with "
-            + f"exception:\n{e}\nTrying in-cluster config..."
+    with phase(report, "namespace"):
+        load_kube_config(context)
+        logger.debug(
+            f"Checking for namespace {namespace} and creating if it doesn't exist"
         )
-        kubernetes.config.load_incluster_config()
-        logger.info("Loaded in-cluster kubeconfig")
-    logger.debug(f"Checking for namespace {namespace} and creating if it doesn't exist")
-    api = CoreV1Api()
-    try:
-        api.read_namespace(namespace)
-    except rest.ApiException as e:
-        if e.status == 404:
-            # Create namespace
-            print(f"Namespace {namespace} does not exist, creating it...")
-            api.create_namespace(V1Namespace(metadata=V1ObjectMeta(name=namespace)))
-        else:
-            raise
+        api = CoreV1Api()
+        try:
+            api.read_namespace(namespace)
+            if namespace_labels:
+                api.patch_namespace(
+                    namespace, {"metadata": {"labels": namespace_labels}}
+                )
+        except rest.ApiException as e:
+            if e.status == 404:
+                # Create namespace
+                print(f"Namespace {namespace} does not exist, creating it...")
+                api.create_namespace(
+                    V1Namespace(
+                        metadata=V1ObjectMeta(name=namespace, labels=namespace_labels)
+                    )
+                )
+            else:
+                raise
 
     cmd = [
         HELM_EXECUTABLE,
@@ -115,12 +174,132 @@ def helm_upgrade(
         cmd += ["--debug"]
     if dry_run:
         cmd += ["--dry-run"]
-    cmd += itertools.chain(*[["-f", cf] for cf in config_files])
-    cmd += itertools.chain(*[["--set", v] for v in config_overrides_implicit])
-    cmd += itertools.chain(*[["--set-string", v] for v in config_overrides_string])
+    if description:
+        cmd += ["--description", description]
+    if history_max is not None:
+        cmd += ["--history-max", str(history_max)]
+    if values_document is not None:
+        # The merged values replace the files and overrides, and are read by
+        # helm from stdin so they never touch the disk.
+        cmd += ["-f", "-"]
+    else:
+        cmd += itertools.chain(*[["-f", cf] for cf in config_files])
+        cmd += itertools.chain(*[["--set", v] for v in config_overrides_implicit])
+        cmd += itertools.chain(*[["--set-string", v] for v in config_overrides_string])
 
     logger.info(f"Running helm upgrade on {name}.")
     logger.debug("Helm upgrade command: " + " ".join(x for x in cmd))
+    with phase(report, "upgrade"):
+        run_helm(cmd, output, input=values_document)
+
+    if report is not None and not dry_run:
+        report["revision"] = helm_status(name, namespace, context)["version"]
+
+
+def update_dependencies(chart, output=None, reuse=False):
+    """
+    Run `helm dep up` for chart
+
+    With reuse, this is skipped if the dependencies were last fetched from the
+    same Chart.yaml and Chart.lock and the fetched charts are still in place.
+    """
+    cache_path = os.path.join(
+        DEPENDENCIES_CACHE_DIR,
+        hashlib.sha256(os.path.abspath(chart).encode()).hexdigest(),
+    )
+    digest = dependencies_digest(chart)
+    if reuse and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            if f.read() == digest:
+                logger.info(f"Reusing the fetched dependencies of {chart}")
+                return
+
+    logger.debug(f"Running helm dep up in subdirectory '{chart}'")
+    run_helm([HELM_EXECUTABLE, "dep", "up"], output, cwd=chart)
+
+    os.makedirs(DEPENDENCIES_CACHE_DIR, exist_ok=True)
+    with open(cache_path, "w") as f:
+        f.write(dependencies_digest(chart))
+
+
+def dependencies_digest(chart):
+    """
+    Returns a digest over the dependency declarations of chart and the names
+    and sizes of the charts fetched into its charts/ directory.
+    """
+    h = hashlib.sha256()
+    for filename in ["Chart.yaml", "Chart.lock", "requirements.lock"]:
+        path = os.path.join(chart, filename)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(filename.encode() + b"\0" + f.read() + b"\0")
+    charts_dir = os.path.join(chart, "charts")
+    if os.path.isdir(charts_dir):
+        for entry in sorted(os.listdir(charts_dir)):
+            size = os.path.getsize(os.path.join(charts_dir, entry))
+            h.update(f"charts/{entry}:{size}\0".encode())
+    return h.hexdigest()
+
+
+def run_helm(cmd, output=None, cwd=None, input=None):
+    """
+    Run a helm command, raising CalledProcessError if it fails
+
+    If output (a HelmOutput) is given, the command's output is streamed
+    through it. input, if given, is written to the command's stdin.
+    """
+    if output is None:
+        subprocess.run(cmd, cwd=cwd, input=input, text=True, check=True)
+    else:
+        output.run(cmd, cwd=cwd, input=input)
+
+
+def helm_status(name, namespace, context):
+    """
+    Returns the status of the deployed revision of release name.
+    """
+    cmd = [HELM_EXECUTABLE, "status", name, "--namespace", namespace]
+    cmd += ["--output", "json"]
+    if context:
+        cmd += ["--kube-context", context]
+    logger.debug("Helm status command: " + " ".join(cmd))
+    return json.loads(subprocess.check_output(cmd))
+
+
+@contextmanager
+def phase(report, name):
+    """
+    Record how long the body takes, in seconds, as report["phases"][name].
+
+    Does nothing if report is None.
+    """
+    if report is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        report.setdefault("phases", {})[name] = time.perf_counter() - start
+
+
+def helm_rollback(name, namespace, context, revision=None, wait=False, timeout=None):
+    """
+    Roll release name back to revision, or to its previous revision if
+    revision is None.
+    """
+    cmd = [HELM_EXECUTABLE, "rollback", name]
+    if revision:
+        cmd += [str(revision)]
+    cmd += ["--namespace", namespace]
+    if context:
+        cmd += ["--kube-context", context]
+    if wait:
+        cmd += ["--wait"]
+    if timeout:
+        cmd += ["--timeout", timeout]
+
+    logger.debug("Helm rollback command: " + " ".join(cmd))
     subprocess.check_call(cmd)
 
 
@@ -140,6 +319,15 @@ def deploy(
     verbose=False,
     helm_debug=False,
     dry_run=False,
+    use_sops_cache=False,
+    skip_probes=False,
+    report=None,
+    name=None,
+    namespace_labels=None,
+    reuse_dependencies=False,
+    merge_values=False,
+    helm_output_tail=None,
+    helm_log_dir=None,
 ):
     """
     Deploy a JupyterHub.
@@ -160,6 +348,34 @@ def deploy(
 
     `jupyterhub.singleuser.image.tag` will be automatically set to this image
     tag.
+
+    If use_sops_cache is set, decrypted secrets are kept for the run, so a
+    secrets file with the same encrypted contents is only decrypted once (see
+    auth.sops_cache).
+
+    If hubploy.yaml configures `probes`, they are run once the upgrade is done
+    (unless skip_probes is set), and the deploy fails, or is rolled back,
+    when they exceed their thresholds.
+
+    The output of helm is streamed through a HelmOutput, which redacts
+    secrets from it. With helm_output_tail it is not written to the terminal,
+    and only its last helm_output_tail lines are printed if helm fails. With
+    helm_log_dir it is also written to {helm_log_dir}/{name}.log.gz.
+
+    If report is a dict, it is filled in as the deploy progresses with the
+    release name, namespace, input digest, the duration of each phase, the
+    last lines of helm output and the deployed helm revision. The output of
+    helm is then not written to the terminal.
+
+    The release name defaults to "{deployment}-{environment}". The namespace,
+    which defaults to the release name, is labelled with namespace_labels.
+    With reuse_dependencies, `helm dep up` is skipped when the chart's
+    dependencies are unchanged since it last ran.
+
+    With merge_values, the config files, decrypted secret files and overrides
+    are merged in-process (see values.merge_values) and handed to helm as one
+    document over stdin. The digest of that document is logged, and recorded
+    in report as values_digest.
     """
     if verbose:
         logger.setLevel(logging.INFO)
@@ -175,54 +391,78 @@ def deploy(
 
     logger.info(f"Getting image and deployment config for {deployment}")
     config = get_config(deployment, debug, verbose)
-    name = f"{deployment}-{environment}"
+    if name is None:
+        name = f"{deployment}-{environment}"
 
     if namespace is None:
         namespace = name
-    helm_config_files = [
-        f
-        for f in [
-            os.path.join("deployments", deployment, "config", "common.yaml"),
-            os.path.join("deployments", deployment, "config", f"{environment}.yaml"),
-        ]
-        if os.path.exists(f)
-    ]
+    helm_config_files = get_helm_config_files(deployment, environment)
     logger.debug(f"Using helm config files: {helm_config_files}")
 
-    helm_secret_files = [
-        f
-        for f in [
-            # Support for secrets in same repo
-            os.path.join("deployments", deployment, "secrets", f"{environment}.yaml"),
-            # Support for secrets in a submodule repo
-            os.path.join(
-                "secrets", "deployments", deployment, "secrets", f"{environment}.yaml"
-            ),
-        ]
-        if os.path.exists(f)
-    ]
+    helm_secret_files = get_helm_secret_files(deployment, environment)
     logger.debug(f"Using helm secret files: {helm_secret_files}")
 
     validate_image_configs(helm_config_files)
 
+    digest = input_digest(
+        deployment,
+        chart,
+        environment,
+        helm_config_overrides_implicit,
+        helm_config_overrides_string,
+        version,
+    )
+    logger.info(f"Input digest for {name} is {digest}")
+    if report is not None:
+        report.update(name=name, namespace=namespace, digest=digest)
+
     with ExitStack() as stack:
-        # Use any specified kubeconfig context. A value of {namespace} will be
-        # templated. A value of None will be interpreted as the current context.
-        template_vars = dict(namespace=namespace)
-        context = config.get("cluster", {}).get("kubeconfig", {}).get("context")
-        if context:
-            context = context.format(**template_vars)
-
-        decrypted_secret_files = [
-            stack.enter_context(decrypt_file(f)) for f in helm_secret_files
-        ]
+        context = get_kube_context(config, namespace)
+
+        if use_sops_cache:
+            stack.enter_context(sops_cache())
+
+        with phase(report, "decrypt"):
+            decrypted_secret_files = [
+                stack.enter_context(decrypt_file(f)) for f in helm_secret_files
+            ]
+
+        values_document = None
+        if merge_values:
+            with phase(report, "values"):
+                values_document = merged_values_document(
+                    helm_config_files,
+                    decrypted_secret_files,
+                    helm_config_overrides_implicit,
+                    helm_config_overrides_string,
+                    report,
+                )
+
+        helm_output = stack.enter_context(
+            HelmOutput(
+                name,
+                echo=report is None and helm_output_tail is None,
+                tail_lines=helm_output_tail or DEFAULT_TAIL_LINES,
+                log_dir=helm_log_dir,
+                secrets=set().union(
+                    *[
+                        secret_strings(values.load_values_file(f))
+                        for f in decrypted_secret_files
+                    ]
+                ),
+                show_tail_on_failure=report is None,
+            )
+        )
+        if report is not None:
+            stack.callback(_report_output, report, helm_output)
 
         # Just in time for k8s access, activate the cluster credentials
         logger.debug(
             "Activating cluster credentials for deployment "
             + f"{deployment} and performing deployment upgrade."
         )
-        stack.enter_context(cluster_auth(deployment, debug, verbose))
+        with phase(report, "auth"):
+            stack.enter_context(cluster_auth(deployment, debug, verbose))
         helm_upgrade(
             name,
             namespace,
@@ -240,4 +480,291 @@ def deploy(
             verbose,
             helm_debug,
             dry_run,
+            DESCRIPTION_DIGEST_PREFIX + digest,
+            get_history_max(config),
+            report,
+            namespace_labels,
+            reuse_dependencies,
+            values_document,
+            helm_output,
         )
+
+        probe_config = config.get("probes")
+        if probe_config and not (dry_run or skip_probes):
+            template_vars = dict(
+                deployment=deployment,
+                environment=environment,
+                namespace=namespace,
+                name=name,
+            )
+            try:
+                with phase(report, "probes"):
+                    probe.verify_deployment(probe_config, template_vars)
+            except probe.ProbeFailedError:
+                if probe_config.get("on_failure") == "rollback":
+                    print(f"Smoke probes failed, rolling back {name}")
+                    try:
+                        helm_rollback(name, namespace, context, wait=True)
+                    except subprocess.CalledProcessError as e:
+                        # e.g. a first install has no revision to roll back to;
+                        # report the probe failure rather than this one
+                        logger.error(f"Rolling back {name} failed: {e}")
+                raise
+
+
+def _report_output(report, helm_output):
+    report["output"] = helm_output.tail()
+
+
+def merged_values_document(
+    config_files,
+    secret_files,
+    config_overrides_implicit,
+    config_overrides_string,
+    report=None,
+):
+    """
+    Returns the canonical document of the effective helm values of a deploy.
+
+    The values, with secrets redacted, are logged at debug level.
+    """
+    effective = values.merge_values(
+        config_files + secret_files, config_overrides_implicit, config_overrides_string
+    )
+    secret_values = values.merge_values(secret_files)
+    digest = values.values_digest(effective)
+    logger.info(f"Effective values digest is {digest}")
+    logger.debug(
+        "Effective values: "
+        + json.dumps(values.redact(effective, secret_values), indent=2, default=str)
+    )
+    if report is not None:
+        report["values_digest"] = digest
+    return values.canonical_document(effective)
+
+
+def get_kube_context(config, namespace):
+    """
+    Returns the kubeconfig context to use for a deployment's hubploy config
+
+    A value of {namespace} in the configured context will be templated. A value
+    of None will be interpreted as the current context.
+    """
+    template_vars = dict(namespace=namespace)
+    context = config.get("cluster", {}).get("kubeconfig", {}).get("context")
+    if context:
+        context = context.format(**template_vars)
+    return context
+
+
+def get_history_max(config):
+    """
+    Returns the number of helm revisions to keep for a deployment's hubploy
+    config, or None to use helm's default.
+
+    In hubploy.yaml include:
+
+    helm:
+      history_max: 10
+    """
+    return config.get("helm", {}).get("history_max")
+
+
+def get_helm_config_files(deployment, environment):
+    """
+    Returns the existing helm config files for deployment in environment, in
+    the order they are passed to helm.
+    """
+    return [
+        f
+        for f in [
+            os.path.join("deployments", deployment, "config", "common.yaml"),
+            os.path.join("deployments", deployment, "config", f"{environment}.yaml"),
+        ]
+        if os.path.exists(f)
+    ]
+
+
+def get_helm_secret_files(deployment, environment):
+    """
+    Returns the existing (possibly encrypted) helm secret files for deployment
+    in environment.
+    """
+    return [
+        f
+        for f in [
+            # Support for secrets in same repo
+            os.path.join("deployments", deployment, "secrets", f"{environment}.yaml"),
+            # Support for secrets in a submodule repo
+            os.path.join(
+                "secrets", "deployments", deployment, "secrets", f"{environment}.yaml"
+            ),
+        ]
+        if os.path.exists(f)
+    ]
+
+
+def input_digest(
+    deployment,
+    chart,
+    environment,
+    helm_config_overrides_implicit=None,
+    helm_config_overrides_string=None,
+    version=None,
+):
+    """
+    Returns a digest over everything a deploy of deployment is made from
+
+    This covers hubploy.yaml, the helm config files, the encrypted secret
+    files, the chart sources (but not the dependencies `helm dep up` fetches
+    into charts/) and the command line overrides. Two deploys with the same
+    digest install the same release.
+    """
+    h = hashlib.sha256()
+
+    def add(label, data):
+        h.update(label.encode())
+        h.update(b"\0")
+        h.update(data)
+        h.update(b"\0")
+
+    add("environment", environment.encode())
+    add("version", (version or "").encode())
+    for v in helm_config_overrides_implicit or []:
+        add("set", v.encode())
+    for v in helm_config_overrides_string or []:
+        add("set-string", v.encode())
+
+    files = [os.path.join("deployments", deployment, "hubploy.yaml")]
+    files += get_helm_config_files(deployment, environment)
+    files += get_helm_secret_files(deployment, environment)
+    for root, dirs, filenames in os.walk(chart):
+        if root == chart and "charts" in dirs:
+            dirs.remove("charts")
+        dirs.sort()
+        files += [os.path.join(root, f) for f in sorted(filenames)]
+
+    for path in files:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                add(path, f.read())
+
+    return h.hexdigest()
+
+
+def helm_error_line(output):
+    """
+    Returns the last "Error: ..." line helm wrote to output, or None.
+    """
+    for line in reversed(output.splitlines()):
+        if line.startswith("Error:"):
+            return line
+    return None
+
+
+def is_transient_failure(e):
+    """
+    True if the exception e is a helm or Kubernetes API failure that may
+    succeed on retry.
+
+    A failed command is only retried if it is helm and its final "Error:"
+    line shows a transient cause; a sops decrypt failure, a chart template error or an
+    invalid --set fails the same way every time.
+    """
+    if isinstance(e, subprocess.CalledProcessError):
+        if os.path.basename(e.cmd[0]) != os.path.basename(HELM_EXECUTABLE):
+            return False
+        error = helm_error_line(e.output or "")
+        return bool(error and TRANSIENT_HELM_ERROR.search(error))
+    if isinstance(e, rest.ApiException):
+        return e.status in TRANSIENT_API_STATUSES
+    return isinstance(e, urllib3.exceptions.HTTPError)
+
+
+def deploy_many(
+    deployments,
+    chart,
+    environment,
+    checkpoint_path=None,
+    resume=False,
+    retries=0,
+    retry_backoff=10,
+    **kwargs,
+):
+    """
+    Deploy several JupyterHubs one after another.
+
+    kwargs are passed on to deploy(). Transient failures of a deployment are
+    retried up to retries times, waiting retry_backoff seconds before the first
+    retry and doubling the wait after that. The run stops at the first
+    deployment that still fails.
+
+    If checkpoint_path is given, the status and input digest of each
+    deployment is recorded there as the run progresses. With resume, any
+    deployment the checkpoint records as deployed with the same input digest
+    is skipped.
+    """
+    if resume and not checkpoint_path:
+        raise ValueError("Resuming a run requires a checkpoint file")
+
+    state = None
+    if checkpoint_path:
+        state = checkpoint.load_checkpoint(checkpoint_path)
+
+    # Share one cache of decrypted secrets across every deployment in the run
+    if kwargs.get("use_sops_cache"):
+        secrets_cache = sops_cache()
+    else:
+        secrets_cache = nullcontext()
+
+    with secrets_cache:
+        for deployment in deployments:
+            name = f"{deployment}-{environment}"
+            digest = input_digest(
+                deployment,
+                chart,
+                environment,
+                kwargs.get("helm_config_overrides_implicit"),
+                kwargs.get("helm_config_overrides_string"),
+                kwargs.get("version"),
+            )
+            if resume and checkpoint.is_deployed(state, name, digest):
+                print(f"Skipping {name}, already deployed with digest {digest[:12]}")
+                continue
+
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    deploy(deployment, chart, environment, **kwargs)
+                    break
+                except Exception as e:
+                    if attempt <= retries and is_transient_failure(e):
+                        wait = retry_backoff * 2 ** (attempt - 1)
+                        logger.warning(
+                            f"Deploying {name} failed on attempt {attempt} with {e!r}, "
+                            + f"retrying in {wait} seconds"
+                        )
+                        time.sleep(wait)
+                        continue
+                    if state is not None and not kwargs.get("dry_run"):
+                        checkpoint.record_deployment(
+                            checkpoint_path,
+                            state,
+                            name,
+                            checkpoint.STATUS_FAILED,
+                            digest,
+                            attempt,
+                            error=repr(e),
+                        )
+                    raise
+
+            if state is not None and not kwargs.get("dry_run"):
+                checkpoint.record_deployment(
+                    checkpoint_path,
+                    state,
+                    name,
+                    checkpoint.STATUS_DEPLOYED,
+                    digest,
+                    attempt,
+                )
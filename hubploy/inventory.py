@@ -0,0 +1,273 @@
+"""
+Utils to index every deployment under deployments/ (load_inventory) and to
+pick deployments by attribute with a label selector (select).
+
+The inventory records, for each deployment, its cluster provider and cluster
+name, the labels in its hubploy.yaml and which config and secret files it has.
+It is cached in INVENTORY_CACHE_DIR, in a file per repository (see
+inventory_path), and an entry is only rebuilt when the modification time of
+its hubploy.yaml, or of one of the directories holding its files, changes, so
+resolving a selector does not reparse every deployment's config on each run.
+
+In hubploy.yaml include:
+
+labels:
+  tier: large
+  team: data8
+
+A selector is a comma separated list of requirements, all of which must hold:
+key=value (or key==value), key!=value, key (the key is set) and !key (it is
+not). The keys provider, cluster and name match those attributes of the
+deployment; any other key matches its labels.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from hubploy.config import DeploymentNotFoundError, get_config
+
+logger = logging.getLogger(__name__)
+
+# Where the inventory of each deployment repository is cached, outside of the
+# repository so it never needs to be ignored.
+INVENTORY_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "hubploy",
+    "inventory",
+)
+INVENTORY_VERSION = 2
+# Selector keys that match attributes of a deployment rather than its labels
+ATTRIBUTE_KEYS = ("name", "provider", "cluster")
+
+
+class SelectorParseError(Exception):
+    def __init__(self, selector, reason, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selector = selector
+        self.reason = reason
+
+    def __str__(self):
+        return f"failed to parse selector {self.selector!r}: {self.reason}"
+
+
+def watched_paths(deployment):
+    """
+    Returns the paths whose modification times invalidate the inventory entry
+    of deployment. Adding or removing a file changes the mtime of its
+    directory.
+    """
+    deployment_path = os.path.join("deployments", deployment)
+    return [
+        deployment_path,
+        os.path.join(deployment_path, "hubploy.yaml"),
+        os.path.join(deployment_path, "config"),
+        os.path.join(deployment_path, "secrets"),
+        os.path.join("secrets", "deployments", deployment, "secrets"),
+    ]
+
+
+def path_mtimes(deployment):
+    """
+    Returns the modification time (in ns, or None if it does not exist) of
+    each of the watched paths of deployment.
+    """
+    mtimes = {}
+    for path in watched_paths(deployment):
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[path] = None
+    return mtimes
+
+
+def build_entry(deployment, mtimes=None):
+    """
+    Returns the inventory entry of deployment.
+    """
+    config = get_config(deployment) or {}
+    cluster = config.get("cluster", {})
+    provider = cluster.get("provider")
+    provider_config = cluster.get(provider, {}) if provider else {}
+    if provider == "kubeconfig":
+        cluster_name = provider_config.get("context")
+    else:
+        cluster_name = provider_config.get("cluster")
+
+    deployment_path = os.path.join("deployments", deployment)
+    secret_dirs = [
+        os.path.join(deployment_path, "secrets"),
+        os.path.join("secrets", "deployments", deployment, "secrets"),
+    ]
+    return {
+        "provider": provider,
+        "cluster": cluster_name,
+        "labels": {
+            str(k): _label_value(v) for k, v in (config.get("labels") or {}).items()
+        },
+        "config_files": _list_files(os.path.join(deployment_path, "config")),
+        "secret_files": sorted(
+            {f for secret_dir in secret_dirs for f in _list_files(secret_dir)}
+        ),
+        "mtimes": mtimes if mtimes is not None else path_mtimes(deployment),
+    }
+
+
+def inventory_path():
+    """
+    Returns the path of the cached inventory of the deployment repository in
+    the current directory, keyed by its absolute path.
+    """
+    key = hashlib.sha256(os.path.abspath(".").encode()).hexdigest()
+    return os.path.join(INVENTORY_CACHE_DIR, f"{key}.json")
+
+
+def load_inventory(path=None):
+    """
+    Returns the inventory of all deployments, as a dict of deployment name to
+    entry, rebuilding the entries that are out of date and updating the cache
+    at path (by default, inventory_path()) if any were.
+    """
+    if path is None:
+        path = inventory_path()
+    cached = {}
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") == INVENTORY_VERSION:
+            cached = data["deployments"]
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    deployments = []
+    for d in sorted(os.listdir("deployments")):
+        deployment_path = os.path.join("deployments", d)
+        if not os.path.isdir(deployment_path):
+            continue
+        if not os.path.isfile(os.path.join(deployment_path, "hubploy.yaml")):
+            logger.warning(f"Skipping {deployment_path}, it has no hubploy.yaml")
+            continue
+        deployments.append(d)
+    inventory = {}
+    changed = set(cached) != set(deployments)
+    for deployment in deployments:
+        mtimes = path_mtimes(deployment)
+        entry = cached.get(deployment)
+        if entry is None or entry["mtimes"] != mtimes:
+            logger.info(f"Indexing deployment {deployment}")
+            entry = build_entry(deployment, mtimes)
+            changed = True
+        inventory[deployment] = entry
+
+    if changed:
+        logger.debug(f"Writing inventory of {len(inventory)} deployments to {path}")
+        _write_inventory(path, inventory)
+    return inventory
+
+
+def parse_selector(selector):
+    """
+    Returns the requirements of selector as (key, operator, value) tuples,
+    where operator is one of "=", "!=", "exists" and "!exists".
+    """
+    requirements = []
+    for term in selector.split(","):
+        term = term.strip()
+        if not term:
+            raise SelectorParseError(selector, "empty requirement")
+        if "!=" in term:
+            key, value = term.split("!=", 1)
+            operator = "!="
+        elif "=" in term:
+            key, value = term.split("==", 1) if "==" in term else term.split("=", 1)
+            operator = "="
+        elif term.startswith("!"):
+            key, value, operator = term[1:], None, "!exists"
+        else:
+            key, value, operator = term, None, "exists"
+        key = key.strip()
+        if not key:
+            raise SelectorParseError(selector, f"requirement {term!r} has no key")
+        if value is not None:
+            value = value.strip()
+        requirements.append((key, operator, value))
+    return requirements
+
+
+def matches(name, entry, requirements):
+    """
+    Returns whether the deployment name, with inventory entry entry, meets all
+    of requirements.
+    """
+    attributes = {
+        "name": name,
+        "provider": entry["provider"],
+        "cluster": entry["cluster"],
+    }
+    for key, operator, value in requirements:
+        if key in ATTRIBUTE_KEYS:
+            actual = attributes[key]
+        else:
+            actual = entry["labels"].get(key)
+        actual = None if actual is None else str(actual)
+        if operator == "=" and actual != value:
+            return False
+        if operator == "!=" and actual == value:
+            return False
+        if operator == "exists" and actual is None:
+            return False
+        if operator == "!exists" and actual is not None:
+            return False
+    return True
+
+
+def select(selector, deployments=None, path=None):
+    """
+    Returns the sorted names of the deployments that match selector, out of
+    deployments if given, or else out of all deployments. Raises
+    DeploymentNotFoundError if one of deployments is not in the inventory.
+    """
+    requirements = parse_selector(selector)
+    inventory = load_inventory(path)
+    candidates = inventory if not deployments else deployments
+    for d in candidates:
+        if d not in inventory:
+            raise DeploymentNotFoundError(d, os.path.join("deployments", d))
+    return sorted(d for d in candidates if matches(d, inventory[d], requirements))
+
+
+def _label_value(value):
+    # Write booleans the way kubectl does, so gpu=true matches "gpu: true"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _list_files(directory):
+    try:
+        return sorted(
+            f
+            for f in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, f))
+        )
+    except FileNotFoundError:
+        return []
+
+
+def _write_inventory(path, inventory):
+    # Write to a temporary file and rename it, so concurrent runs never read a
+    # truncated inventory.
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, prefix=".inventory-", delete=False
+    ) as f:
+        json.dump(
+            {"version": INVENTORY_VERSION, "deployments": inventory},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+    os.replace(f.name, path)
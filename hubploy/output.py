@@ -0,0 +1,217 @@
+"""
+Util to run the helm commands of a deployment with their output streamed line
+by line (HelmOutput), so that memory use stays constant however much helm
+writes.
+
+Each line is redacted as it streams, then echoed to the terminal, appended to
+a ring buffer of the last lines and, optionally, written to a gzip compressed
+per-deployment log file. When live echo is off, the tail is printed if a
+command fails.
+"""
+
+import collections
+import gzip
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TAIL_LINES = 200
+# Longer lines are split, so one huge line cannot grow the buffer unbounded
+MAX_LINE_LENGTH = 64 * 1024
+# Secrets shorter than this are too likely to match unrelated output
+MIN_SECRET_LENGTH = 4
+REDACTED = "<redacted>"
+# How much of a split line is held back for REDACT_PATTERNS, so that a
+# credential key cut by the split still matches with the next part
+PATTERN_OVERLAP = 64
+REDACT_PATTERNS = [
+    # key: value and key=value pairs whose key looks like a credential. The
+    # pattern starts at the sensitive word, so it stays linear on long lines.
+    re.compile(
+        r"(?i)((?:pass(?:word)?|secret|token|credential|private|api_?key)"
+        r"[\w.\"'-]*\s*[:=]\s*)\S.*"
+    ),
+    re.compile(r"(?i)(bearer\s+)\S+"),
+    re.compile(r"()AKIA[0-9A-Z]{16}"),
+    re.compile(r"()-----BEGIN [A-Z ]*PRIVATE KEY-----"),
+]
+
+
+def secret_strings(values):
+    """
+    Returns every scalar leaf of values (for example, of a decrypted secrets
+    file), as a string, that is long enough to be redacted from output.
+    Numbers count too, since a numeric PIN or port is printed like any other
+    value; booleans and nulls do not.
+    """
+    if isinstance(values, dict):
+        values = list(values.values())
+    if isinstance(values, list):
+        return {s for v in values for s in secret_strings(v)}
+    if isinstance(values, bool) or not isinstance(values, (str, int, float)):
+        return set()
+    value = str(values)
+    if len(value) >= MIN_SECRET_LENGTH:
+        return {value}
+    return set()
+
+
+class HelmOutput:
+    """
+    Runs commands with their output streamed through redaction, a ring buffer
+    of the last tail_lines lines and, if log_dir is given, the gzip compressed
+    log file {log_dir}/{name}.log.gz.
+
+    With echo, lines are also written to the terminal as they arrive. With
+    show_tail_on_failure, the buffered tail is printed when a command fails.
+    """
+
+    def __init__(
+        self,
+        name,
+        echo=True,
+        tail_lines=DEFAULT_TAIL_LINES,
+        log_dir=None,
+        secrets=(),
+        show_tail_on_failure=False,
+    ):
+        self.name = name
+        self.echo = echo
+        self.show_tail_on_failure = show_tail_on_failure
+        self.lines = collections.deque(maxlen=tail_lines)
+        # Replace longer secrets first, in case one contains another
+        self.secrets = sorted(set(secrets), key=len, reverse=True)
+        # How much of a split line to hold back, so a secret straddling the
+        # split is still whole when the next part arrives
+        self.overlap = max(
+            len(self.secrets[0]) - 1 if self.secrets else 0, PATTERN_OVERLAP
+        )
+        self.log = None
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            log_path = os.path.join(log_dir, f"{name}.log.gz")
+            logger.info(f"Writing helm output for {name} to {log_path}")
+            self.log = gzip.open(log_path, "wt", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def tail(self):
+        """
+        Returns the buffered last lines of output, as one string.
+        """
+        return "".join(self.lines)
+
+    def redact(self, line):
+        for secret in self.secrets:
+            line = line.replace(secret, REDACTED)
+        for pattern in REDACT_PATTERNS:
+            line = pattern.sub(lambda m: m.group(1) + REDACTED, line)
+        return line
+
+    def _matches_to_end(self, text):
+        # True if a redacted pattern runs to the end of text, so its value
+        # may go on in the next part of a split line
+        return any(
+            m.end() == len(text)
+            for pattern in REDACT_PATTERNS
+            for m in pattern.finditer(text)
+        )
+
+    def add_line(self, line):
+        self._write(self.redact(line))
+
+    def _write(self, line):
+        self.lines.append(line)
+        if self.log is not None:
+            self.log.write(line)
+        if self.echo:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def run(self, cmd, cwd=None, input=None):
+        """
+        Run cmd, streaming its output, and raise CalledProcessError (with the
+        buffered tail as its output) if it fails. input, if given, is written
+        to the command's stdin.
+        """
+        if self.log is not None:
+            self.log.write(f"$ {self.redact(' '.join(cmd))}\n")
+        proc = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+        writer = None
+        if input is not None:
+            # Feed stdin from a thread, so a command that writes output before
+            # it has read all of its input cannot deadlock against us.
+            writer = threading.Thread(target=_feed, args=(proc.stdin, input))
+            writer.start()
+
+        # Redacted text of a split line, held back until the next part of it
+        pending = ""
+        # Whether a redacted value runs on past the split of a line
+        redacting = False
+        while True:
+            line = proc.stdout.readline(MAX_LINE_LENGTH)
+            if not line:
+                break
+            if redacting:
+                # Drop the rest of the value, up to the real end of line
+                redacting = not line.endswith("\n")
+                continue
+            if line.endswith("\n"):
+                self.add_line(pending + line)
+                pending = ""
+                continue
+            if self._matches_to_end(pending + line):
+                self.add_line(pending + line + "\n")
+                pending = ""
+                redacting = True
+                continue
+            text = self.redact(pending + line)
+            split = max(len(text) - self.overlap, 0)
+            if split:
+                self._write(text[:split] + "\n")
+            pending = text[split:]
+        if pending:
+            self.add_line(pending + "\n")
+        proc.stdout.close()
+        returncode = proc.wait()
+        if writer is not None:
+            writer.join()
+
+        if returncode != 0:
+            if self.show_tail_on_failure and not self.echo:
+                print(
+                    f"{cmd[0]} failed for {self.name}, last {len(self.lines)} "
+                    + "lines of output:"
+                )
+                sys.stdout.write(self.tail())
+            raise subprocess.CalledProcessError(returncode, cmd, output=self.tail())
+
+
+def _feed(stream, data):
+    try:
+        stream.write(data)
+        stream.close()
+    except BrokenPipeError:
+        pass
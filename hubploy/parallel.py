@@ -0,0 +1,49 @@
+"""
+Util to run a per-deployment operation over several deployments concurrently
+(map_deployments).
+
+Cluster authentication changes process wide state such as KUBECONFIG and the
+AWS credential environment variables, so operations on different deployments
+cannot share a process. Concurrent operations each run in their own worker
+process instead.
+"""
+
+import logging
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+
+def map_deployments(fn, deployments, environment, parallel=1, **kwargs):
+    """
+    Call fn(deployment, environment, **kwargs) for every deployment, up to
+    parallel at a time.
+
+    Every call is attempted. Returns a dict of the results by deployment and a
+    dict of the exceptions raised by the deployments that failed.
+    """
+    results = {}
+    failed = {}
+    if parallel <= 1:
+        for deployment in deployments:
+            try:
+                results[deployment] = fn(deployment, environment, **kwargs)
+            except Exception as e:
+                logger.error(f"{deployment} failed: {e}")
+                failed[deployment] = e
+        return results, failed
+
+    with ProcessPoolExecutor(max_workers=parallel) as executor:
+        futures = {
+            executor.submit(fn, deployment, environment, **kwargs): deployment
+            for deployment in deployments
+        }
+        for future in as_completed(futures):
+            deployment = futures[future]
+            try:
+                results[deployment] = future.result()
+            except Exception as e:
+                logger.error(f"{deployment} failed: {e}")
+                failed[deployment] = e
+    return results, failed
@@ -0,0 +1,311 @@
+"""
+Utils to run throwaway preview deployments of a hub for pull requests.
+
+A preview of a deployment for pull request N deploys the deployment's develop
+config as release "{deployment}-pr-{N}" in a namespace of the same name (up),
+and is torn down with down. The namespace is labelled as a preview and with an
+expiry time, which every up moves forward, so that gc can delete all expired
+previews in bulk.
+
+Repeat pushes to a pull request only update the release: chart dependencies are
+not fetched again while they are unchanged, and with a secrets cache directory
+decrypted secrets are reused while their encrypted contents are unchanged.
+
+A preview must not claim what the develop hub already holds, such as its
+ingress hosts or reserved load balancer IP. Give it its own with overrides in
+hubploy.yaml, which can use {deployment}, {pr} and {name} (the release name):
+
+preview:
+  set:
+    - ingress.hosts[0]=pr-{pr}.develop.example.org
+  set_string: []
+
+up refuses to deploy a preview that would reuse any of EXCLUSIVE_VALUES of the
+develop config.
+"""
+
+import logging
+import re
+import subprocess
+import sys
+import time
+
+from contextlib import contextmanager, nullcontext
+from kubernetes.client import CoreV1Api, rest
+
+from hubploy import helm, values
+from hubploy.auth import cluster_auth, sops_cache
+from hubploy.config import get_config
+from hubploy.parallel import map_deployments
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_ENVIRONMENT = "develop"
+PREVIEW_LABEL = "hubploy.io/preview"
+DEPLOYMENT_LABEL = "hubploy.io/deployment"
+PR_LABEL = "hubploy.io/pr"
+# Unix time after which the preview may be deleted
+EXPIRES_AT_LABEL = "hubploy.io/expires-at"
+DEFAULT_TTL_HOURS = 72
+# Values naming resources that only one hub can hold at a time, as paths into
+# the helm values. They are also looked for under a wrapper chart's
+# jupyterhub key.
+EXCLUSIVE_VALUES = [
+    ("ingress", "hosts"),
+    ("proxy", "service", "loadBalancerIP"),
+]
+
+
+class PreviewConflictError(Exception):
+    def __init__(self, name, conflicts, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.conflicts = conflicts
+
+    def __str__(self):
+        return (
+            f"preview {self.name} would reuse the develop config's "
+            + ", ".join(self.conflicts)
+            + "; override them under preview in hubploy.yaml"
+        )
+
+
+def preview_name(deployment, pr):
+    """
+    Returns the release name, which is also the namespace, of a preview.
+
+    pr must be a pull request number, since it ends up in release names and
+    label values.
+    """
+    if not re.fullmatch(r"[0-9]+", str(pr)):
+        raise ValueError(f"Pull request number must be numeric, not {pr!r}")
+    return f"{deployment}-pr-{pr}"
+
+
+def preview_overrides(config, deployment, pr):
+    """
+    Returns the --set and --set-string overrides of the previews of
+    deployment, from the preview section of its hubploy.yaml config, filled in
+    for pull request pr.
+    """
+    preview_config = config.get("preview") or {}
+    template_vars = {
+        "deployment": deployment,
+        "pr": pr,
+        "name": preview_name(deployment, pr),
+    }
+    return (
+        [v.format(**template_vars) for v in preview_config.get("set", [])],
+        [v.format(**template_vars) for v in preview_config.get("set_string", [])],
+    )
+
+
+def find_conflicts(deployment, overrides_implicit, overrides_string):
+    """
+    Returns the paths of EXCLUSIVE_VALUES that a preview of deployment with
+    the given overrides shares with the develop hub.
+
+    Only the config files are read, not the encrypted secret files.
+    """
+    config_files = helm.get_helm_config_files(deployment, PREVIEW_ENVIRONMENT)
+    develop = values.merge_values(config_files)
+    preview = values.merge_values(config_files, overrides_implicit, overrides_string)
+    conflicts = []
+    for path in EXCLUSIVE_VALUES:
+        for prefix in [(), ("jupyterhub",)]:
+            claimed = _claimed(develop, prefix + path) & _claimed(
+                preview, prefix + path
+            )
+            if claimed:
+                conflicts.append(".".join(prefix + path))
+    return conflicts
+
+
+def _claimed(tree, path):
+    # The set of strings the value at path holds, one per item of a list
+    for key in path:
+        if not isinstance(tree, dict):
+            return set()
+        tree = tree.get(key)
+    if tree is None:
+        return set()
+    items = tree if isinstance(tree, list) else [tree]
+    return {str(item) for item in items if item is not None}
+
+
+def up(
+    deployment,
+    chart,
+    pr,
+    ttl_hours=DEFAULT_TTL_HOURS,
+    secrets_cache=None,
+    helm_config_overrides_implicit=None,
+    helm_config_overrides_string=None,
+    timeout=None,
+    debug=False,
+    verbose=False,
+):
+    """
+    Deploy or update the preview of deployment for pull request pr, expiring
+    ttl_hours from now, with the preview overrides of its hubploy.yaml.
+
+    Raises PreviewConflictError if the preview would reuse any of
+    EXCLUSIVE_VALUES of the develop config.
+
+    If secrets_cache is given, decrypted secrets are kept in that directory and
+    reused by later previews (see auth.sops_cache).
+    """
+    if verbose:
+        logger.setLevel(logging.INFO)
+    elif debug:
+        logger.setLevel(logging.DEBUG)
+
+    name = preview_name(deployment, pr)
+    preview_implicit, preview_string = preview_overrides(
+        get_config(deployment), deployment, pr
+    )
+    # Overrides given on the command line take precedence
+    overrides_implicit = preview_implicit + list(helm_config_overrides_implicit or [])
+    overrides_string = preview_string + list(helm_config_overrides_string or [])
+    conflicts = find_conflicts(deployment, overrides_implicit, overrides_string)
+    if conflicts:
+        raise PreviewConflictError(name, conflicts)
+
+    labels = {
+        PREVIEW_LABEL: "true",
+        DEPLOYMENT_LABEL: deployment,
+        PR_LABEL: str(pr),
+        EXPIRES_AT_LABEL: str(int(time.time() + ttl_hours * 3600)),
+    }
+    print(f"Deploying preview {name}, expiring in {ttl_hours} hours")
+
+    if secrets_cache:
+        cache = sops_cache(cache_dir=secrets_cache)
+    else:
+        cache = nullcontext()
+
+    with cache:
+        helm.deploy(
+            deployment,
+            chart,
+            PREVIEW_ENVIRONMENT,
+            helm_config_overrides_implicit=overrides_implicit,
+            helm_config_overrides_string=overrides_string,
+            timeout=timeout,
+            debug=debug,
+            verbose=verbose,
+            skip_probes=True,
+            name=name,
+            namespace_labels=labels,
+            reuse_dependencies=True,
+        )
+
+
+def down(deployment, pr, debug=False, verbose=False):
+    """
+    Delete the preview of deployment for pull request pr.
+    """
+    name = preview_name(deployment, pr)
+    context = _context(deployment, name)
+    with _cluster_api(deployment, context, debug, verbose) as api:
+        _delete_preview(api, name, context)
+
+
+def gc(deployment, environment=None, dry_run=False, debug=False, verbose=False):
+    """
+    Delete every expired preview of deployment. Returns the names of the
+    deleted (or, with dry_run, the expired) previews.
+
+    A preview that fails to be deleted does not stop the others from being
+    deleted; a RuntimeError listing the failed ones is raised at the end.
+
+    environment is unused; it keeps the signature of a per-deployment
+    operation for parallel.map_deployments.
+    """
+    now = time.time()
+    expired = []
+    failed = []
+    with _cluster_api(deployment, _context(deployment, ""), debug, verbose) as api:
+        namespaces = api.list_namespace(
+            label_selector=f"{PREVIEW_LABEL}=true,{DEPLOYMENT_LABEL}={deployment}"
+        ).items
+        for ns in namespaces:
+            expires_at = (ns.metadata.labels or {}).get(EXPIRES_AT_LABEL)
+            if expires_at is None or int(expires_at) > now:
+                continue
+            name = ns.metadata.name
+            if dry_run:
+                print(f"Preview {name} has expired")
+                expired.append(name)
+                continue
+            try:
+                _delete_preview(api, name, _context(deployment, name))
+            except Exception as e:
+                logger.error(f"Deleting preview {name} failed: {e!r}")
+                failed.append(name)
+            else:
+                expired.append(name)
+    if failed:
+        raise RuntimeError(f"Deleting previews failed for: {', '.join(failed)}")
+    return expired
+
+
+def gc_many(deployments, parallel=1, **kwargs):
+    """
+    Delete the expired previews of several deployments, up to parallel of
+    them at a time. A RuntimeError listing the deployments that failed is
+    raised at the end.
+    """
+    results, failed = map_deployments(
+        gc, deployments, PREVIEW_ENVIRONMENT, parallel=parallel, **kwargs
+    )
+    count = sum(len(r) for r in results.values())
+    print(
+        f"{count} expired preview(s) {'found' if kwargs.get('dry_run') else 'deleted'}"
+    )
+    if failed:
+        raise RuntimeError(f"Preview gc failed for: {', '.join(sorted(failed))}")
+
+
+def _context(deployment, namespace):
+    return helm.get_kube_context(get_config(deployment), namespace)
+
+
+@contextmanager
+def _cluster_api(deployment, context, debug=False, verbose=False):
+    """
+    Authenticate to the cluster of deployment and provide a CoreV1Api for it.
+    """
+    with cluster_auth(deployment, debug, verbose):
+        helm.load_kube_config(context)
+        yield CoreV1Api()
+
+
+def _delete_preview(api, name, context):
+    """
+    Uninstall the release of preview name and delete its namespace.
+
+    The namespace is created before the release is installed, so a preview
+    whose first deploy failed has a namespace but no release; that release
+    not being found is not an error.
+    """
+    print(f"Deleting preview {name}")
+    cmd = [helm.HELM_EXECUTABLE, "uninstall", name, "--namespace", name]
+    if context:
+        cmd += ["--kube-context", context]
+    logger.debug("Helm uninstall command: " + " ".join(cmd))
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        if "not found" not in result.stderr:
+            sys.stderr.write(result.stderr)
+            raise subprocess.CalledProcessError(
+                result.returncode, cmd, result.stdout, result.stderr
+            )
+        logger.info(f"Release {name} not found, deleting only its namespace")
+    else:
+        sys.stdout.write(result.stdout)
+    try:
+        api.delete_namespace(name)
+    except rest.ApiException as e:
+        if e.status != 404:
+            raise
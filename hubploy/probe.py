@@ -0,0 +1,192 @@
+"""
+Util to verify a deployed JupyterHub actually serves traffic (verify_deployment)
+by sending smoke probes to the endpoints listed in hubploy.yaml and checking
+their latency and error rate against thresholds.
+
+In hubploy.yaml include:
+
+probes:
+  requests: 20           # requests per target
+  concurrency: 10        # requests in flight at once, across all targets
+  timeout: 5             # seconds per request
+  p95_ms: 1000           # default thresholds, can be overridden per target
+  max_error_rate: 0
+  on_failure: fail       # or rollback
+  targets:
+    - name: hub-api
+      url: https://{deployment}-{environment}.example.org/hub/api
+    - name: proxy-health
+      url: https://{deployment}-{environment}.example.org/hub/health
+      p50_ms: 200
+
+Target urls can use {deployment}, {environment}, {namespace} and {name} (the
+helm release name).
+"""
+
+import asyncio
+import logging
+import math
+import requests
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUESTS = 10
+DEFAULT_CONCURRENCY = 10
+DEFAULT_TIMEOUT = 5
+THRESHOLD_KEYS = ["p50_ms", "p95_ms", "max_error_rate"]
+
+
+class ProbeFailedError(Exception):
+    def __init__(self, failures, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = failures
+
+    def __str__(self):
+        return "smoke probes failed: " + "; ".join(self.failures)
+
+
+def percentile(values, pct):
+    """
+    Returns the pct percentile of values (nearest rank), or None if there are
+    no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+async def _probe_target(session, semaphore, target, count, timeout):
+    expected_status = target.get("expected_status", 200)
+    latencies = []
+    errors = 0
+
+    def probe_once():
+        start = time.perf_counter()
+        response = session.get(target["url"], timeout=timeout)
+        return response.status_code, time.perf_counter() - start
+
+    async def probe():
+        nonlocal errors
+        async with semaphore:
+            try:
+                status, latency = await asyncio.to_thread(probe_once)
+            except requests.RequestException as e:
+                logger.debug(f"Probe of {target['url']} failed: {e}")
+                errors += 1
+                return
+        if status != expected_status:
+            logger.debug(f"Probe of {target['url']} returned {status}")
+            errors += 1
+        else:
+            latencies.append(latency)
+
+    await asyncio.gather(*[probe() for _ in range(count)])
+    return {
+        "name": target["name"],
+        "url": target["url"],
+        "requests": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+async def _probe_all(targets, count, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    # The default executor has min(32, cpus + 4) threads, which would cap the
+    # requests in flight below concurrency on small runners and skew latency.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=concurrency)
+    )
+    with requests.Session() as session:
+        # Size the connection pool so every request in flight reuses a
+        # connection instead of opening a new one.
+        adapter = HTTPAdapter(pool_connections=len(targets), pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return await asyncio.gather(
+            *[
+                _probe_target(session, semaphore, target, count, timeout)
+                for target in targets
+            ]
+        )
+
+
+def run_probes(probe_config, template_vars):
+    """
+    Probe every target in probe_config concurrently and return one result per
+    target, with its request count, error rate and p50/p95 latency in ms.
+    """
+    targets = [
+        dict(target, url=target["url"].format(**template_vars))
+        for target in probe_config.get("targets", [])
+    ]
+    if not targets:
+        return []
+    return asyncio.run(
+        _probe_all(
+            targets,
+            probe_config.get("requests", DEFAULT_REQUESTS),
+            probe_config.get("concurrency", DEFAULT_CONCURRENCY),
+            probe_config.get("timeout", DEFAULT_TIMEOUT),
+        )
+    )
+
+
+def check_results(probe_config, results):
+    """
+    Returns a description of every threshold in probe_config that results
+    exceed. A latency threshold of a target none of whose requests succeeded
+    counts as exceeded.
+    """
+    targets = {t["name"]: t for t in probe_config.get("targets", [])}
+    failures = []
+    for result in results:
+        target = targets.get(result["name"], {})
+        for key in THRESHOLD_KEYS:
+            limit = target.get(key, probe_config.get(key))
+            if limit is None:
+                continue
+            value = result["error_rate" if key == "max_error_rate" else key]
+            if value is None:
+                # Every request failed, so the latency cannot be within limit
+                failures.append(f"{result['name']} {key} has no successful requests")
+            elif value > limit:
+                failures.append(f"{result['name']} {key} {value:.3g} > {limit}")
+    return failures
+
+
+def verify_deployment(probe_config, template_vars):
+    """
+    Run the smoke probes in probe_config, print a report and raise
+    ProbeFailedError if any threshold is exceeded.
+    """
+    logger.info("Running post-deploy smoke probes")
+    results = run_probes(probe_config, template_vars)
+    for result in results:
+        print(
+            f"Probe {result['name']}: {result['requests']} requests, "
+            + f"p50 {_format_ms(result['p50_ms'])}, "
+            + f"p95 {_format_ms(result['p95_ms'])}, "
+            + f"error rate {result['error_rate']:.1%}"
+        )
+
+    failures = check_results(probe_config, results)
+    if failures:
+        raise ProbeFailedError(failures)
+    return results
+
+
+def _format_ms(value):
+    return "n/a" if value is None else f"{value:.0f}ms"
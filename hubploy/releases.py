@@ -0,0 +1,169 @@
+"""
+Utils to inspect (report_release) and prune (prune_release) the helm release
+history of deployments, for one deployment (releases) or several concurrently
+(releases_many).
+
+Helm stores every revision of a release as a Secret in the release namespace,
+labelled owner=helm and name=<release>. Long-lived hubs accumulate hundreds of
+them, which slows down `helm upgrade` and `helm history` and bloats etcd.
+Pruning deletes all but the newest revisions, and never the deployed one.
+
+The number of revisions to keep defaults to the deployment's history_max in
+hubploy.yaml (see helm.get_history_max), which deploys also pass to helm. As
+for helm, keeping 0 revisions means keeping them all, so nothing is pruned.
+"""
+
+import logging
+
+from kubernetes.client import CoreV1Api
+
+from hubploy.auth import cluster_auth
+from hubploy.config import get_config
+from hubploy.helm import get_history_max, get_kube_context, load_kube_config
+from hubploy.parallel import map_deployments
+
+logger = logging.getLogger(__name__)
+
+# helm's own default for --history-max
+DEFAULT_KEEP = 10
+
+
+def list_release_secrets(api, name, namespace):
+    """
+    Returns the secrets storing the revisions of release name, oldest first.
+    """
+    secrets = api.list_namespaced_secret(
+        namespace, label_selector=f"owner=helm,name={name}"
+    ).items
+    return sorted(secrets, key=lambda s: int(s.metadata.labels.get("version", 0)))
+
+
+def secret_size(secret):
+    """
+    Returns the stored size of secret's data in bytes.
+    """
+    return sum(len(v) for v in (secret.data or {}).values())
+
+
+def report_release(api, name, namespace):
+    """
+    Returns the number of stored revisions of release name and their total
+    size in bytes.
+    """
+    secrets = list_release_secrets(api, name, namespace)
+    return {
+        "name": name,
+        "namespace": namespace,
+        "revisions": len(secrets),
+        "bytes": sum(secret_size(s) for s in secrets),
+    }
+
+
+def prune_release(api, name, namespace, keep, dry_run=False):
+    """
+    Delete the stored revisions of release name beyond the newest keep ones.
+
+    The deployed revision is always kept, and with keep 0 (unlimited history)
+    nothing is deleted. Returns the names of the deleted (or, with dry_run,
+    the would be deleted) secrets.
+    """
+    if keep == 0:
+        logger.info(f"History of {name} is unlimited, not pruning")
+        return []
+    secrets = list_release_secrets(api, name, namespace)
+    prunable = [
+        s
+        for s in secrets[: max(len(secrets) - keep, 0)]
+        if s.metadata.labels.get("status") != "deployed"
+    ]
+    deleted = []
+    for secret in prunable:
+        logger.info(f"Deleting release secret {secret.metadata.name} in {namespace}")
+        if not dry_run:
+            api.delete_namespaced_secret(secret.metadata.name, namespace)
+        deleted.append(secret.metadata.name)
+    return deleted
+
+
+def releases(
+    deployment,
+    environment,
+    action,
+    namespace=None,
+    keep=None,
+    dry_run=False,
+    debug=False,
+    verbose=False,
+    api=None,
+):
+    """
+    Report on or prune the helm release history of a deployment.
+
+    Returns the report of the release after any pruning, with the number of
+    pruned revisions. If api is given it is used instead of a CoreV1Api for the
+    deployment's cluster, and no cluster authentication is done.
+    """
+    if verbose:
+        logger.setLevel(logging.INFO)
+    elif debug:
+        logger.setLevel(logging.DEBUG)
+
+    config = get_config(deployment, debug, verbose)
+    name = f"{deployment}-{environment}"
+    if namespace is None:
+        namespace = name
+    if keep is None:
+        keep = get_history_max(config)
+    if keep is None:
+        keep = DEFAULT_KEEP
+    if keep < 0:
+        # A negative count would prune every revision but the deployed one
+        raise ValueError(f"Cannot keep {keep} revisions of {name}")
+
+    if api is None:
+        with cluster_auth(deployment, debug, verbose):
+            load_kube_config(get_kube_context(config, namespace))
+            return _releases(CoreV1Api(), name, namespace, action, keep, dry_run)
+    return _releases(api, name, namespace, action, keep, dry_run)
+
+
+def _releases(api, name, namespace, action, keep, dry_run):
+    pruned = []
+    if action == "prune":
+        pruned = prune_release(api, name, namespace, keep, dry_run)
+    report = report_release(api, name, namespace)
+    report["pruned"] = len(pruned)
+    return report
+
+
+def releases_many(deployments, environment, action, parallel=1, **kwargs):
+    """
+    Report on or prune the helm release history of several deployments, up to
+    parallel of them at a time, and print a summary.
+
+    kwargs are passed on to releases(). A RuntimeError listing the deployments
+    that failed is raised at the end.
+    """
+    results, failed = map_deployments(
+        releases, deployments, environment, parallel=parallel, action=action, **kwargs
+    )
+    pruned_header = "would prune" if kwargs.get("dry_run") else "pruned"
+    print(f"{'release':<40} {'revisions':>10} {'size':>12} {pruned_header:>12}")
+    for deployment in deployments:
+        if deployment not in results:
+            continue
+        r = results[deployment]
+        print(
+            f"{r['name']:<40} {r['revisions']:>10} {_format_bytes(r['bytes']):>12} "
+            + f"{r['pruned']:>12}"
+        )
+    if failed:
+        raise RuntimeError(f"Releases {action} failed for: {', '.join(sorted(failed))}")
+
+
+def _format_bytes(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
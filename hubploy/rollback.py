@@ -0,0 +1,153 @@
+"""
+Util to roll a deployed JupyterHub back to an earlier helm revision (rollback),
+or several of them concurrently (rollback_many).
+
+Rolling back goes straight to `helm rollback` after cluster authentication. No
+secrets are decrypted and no chart dependencies are resolved, since helm keeps
+the rendered manifests and values of every revision.
+
+Each revision deployed by hubploy records the digest of its inputs in the helm
+release description, so a revision can also be chosen by input digest.
+"""
+
+import json
+import logging
+import subprocess
+
+from hubploy.auth import cluster_auth
+from hubploy.config import get_config
+from hubploy.helm import (
+    DESCRIPTION_DIGEST_PREFIX,
+    HELM_EXECUTABLE,
+    get_kube_context,
+    helm_rollback,
+)
+from hubploy.parallel import map_deployments
+
+logger = logging.getLogger(__name__)
+
+
+class RevisionNotFoundError(Exception):
+    def __init__(self, name, digest, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.digest = digest
+
+    def __str__(self):
+        return f"no revision of {self.name} was deployed with digest {self.digest}"
+
+
+class AmbiguousDigestError(Exception):
+    def __init__(self, name, digest, matches, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.digest = digest
+        self.matches = matches
+
+    def __str__(self):
+        return (
+            f"digest prefix {self.digest} of {self.name} matches "
+            + f"{len(self.matches)} digests: {', '.join(self.matches)}"
+        )
+
+
+def get_input_digest(revision):
+    """
+    Returns the input digest recorded for a helm history entry, or None if it
+    was not deployed by hubploy.
+    """
+    description = revision.get("description", "")
+    if description.startswith(DESCRIPTION_DIGEST_PREFIX):
+        return description[len(DESCRIPTION_DIGEST_PREFIX) :]
+    return None
+
+
+def helm_history(name, namespace, context=None):
+    """
+    Returns the helm release history of name, oldest revision first.
+    """
+    cmd = [
+        HELM_EXECUTABLE,
+        "history",
+        name,
+        "--namespace",
+        namespace,
+        "--output",
+        "json",
+    ]
+    if context:
+        cmd += ["--kube-context", context]
+    logger.debug("Helm history command: " + " ".join(cmd))
+    return json.loads(subprocess.check_output(cmd))
+
+
+def find_revision(history, name, digest):
+    """
+    Returns the newest revision in history deployed with the given input
+    digest. A unique prefix of the digest is accepted; a prefix that matches
+    several distinct digests raises AmbiguousDigestError.
+    """
+    matches = {}
+    for revision in history:
+        revision_digest = get_input_digest(revision)
+        if revision_digest and revision_digest.startswith(digest):
+            # History is oldest first, so the newest revision wins
+            matches[revision_digest] = revision["revision"]
+    if not matches:
+        raise RevisionNotFoundError(name, digest)
+    if len(matches) > 1:
+        raise AmbiguousDigestError(name, digest, sorted(matches))
+    return next(iter(matches.values()))
+
+
+def rollback(
+    deployment,
+    environment,
+    namespace=None,
+    revision=None,
+    digest=None,
+    wait=False,
+    timeout=None,
+    debug=False,
+    verbose=False,
+):
+    """
+    Roll a JupyterHub back to an earlier helm revision.
+
+    If neither revision nor digest is given, the release is rolled back to its
+    previous revision.
+    """
+    if verbose:
+        logger.setLevel(logging.INFO)
+    elif debug:
+        logger.setLevel(logging.DEBUG)
+
+    config = get_config(deployment, debug, verbose)
+    name = f"{deployment}-{environment}"
+    if namespace is None:
+        namespace = name
+    context = get_kube_context(config, namespace)
+
+    with cluster_auth(deployment, debug, verbose):
+        if digest:
+            revision = find_revision(
+                helm_history(name, namespace, context), name, digest
+            )
+            logger.info(f"Revision {revision} of {name} matches digest {digest}")
+
+        print(f"Rolling back {name} to revision {revision or 'previous'}")
+        helm_rollback(name, namespace, context, revision, wait, timeout)
+
+
+def rollback_many(deployments, environment, parallel=1, **kwargs):
+    """
+    Roll back several JupyterHubs, up to parallel of them at a time.
+
+    kwargs are passed on to rollback(). Every rollback is attempted, and a
+    RuntimeError listing the deployments that failed is raised at the end.
+    """
+    _, failed = map_deployments(
+        rollback, deployments, environment, parallel=parallel, **kwargs
+    )
+    if failed:
+        raise RuntimeError(f"Rollback failed for: {', '.join(sorted(failed))}")
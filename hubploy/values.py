@@ -0,0 +1,455 @@
+"""
+Utils to compute the effective helm values of a deploy in-process
+(merge_values), as one canonical document (canonical_document) with a digest
+(values_digest) and a redacted view for debugging (redact).
+
+The merge follows helm's precedence: values files are deep merged in the order
+given, later files winning; then every --set is applied, then every
+--set-string. Maps are merged key by key, anything else (including lists) is
+replaced. A null value is kept, so that helm still removes the key from the
+chart defaults.
+
+Values files are read the way helm reads them (with go-yaml v2, see
+_resolve_plain): plain scalars such as yes, on and y are booleans and 0123 is
+an octal integer, but timestamps stay the text they were written as. Map keys
+that are not strings are then turned into strings, as helm does when it
+converts values to JSON, so `on:` is the key "true".
+
+--set and --set-string are parsed like helm's strvals: comma separated
+key=value pairs, dotted keys, list indexes (a[0]=x), list values ({a,b}) and
+backslash escapes. --set values are typed (true/false, null and integers),
+--set-string values are always strings.
+"""
+
+import hashlib
+import json
+import math
+import re
+import struct
+
+from ruamel.yaml import YAML
+from ruamel.yaml.constructor import SafeConstructor
+from ruamel.yaml.nodes import ScalarNode
+from ruamel.yaml.resolver import VersionedResolver
+from ruamel.yaml.tag import Tag
+
+# Every plain (unquoted) scalar is given this tag, and resolved by
+# _resolve_plain instead of by ruamel.
+PLAIN_TAG = "tag:hubploy,2025:plain"
+MERGE_TAG = "tag:yaml.org,2002:merge"
+TIMESTAMP_TAG = "tag:yaml.org,2002:timestamp"
+
+REDACTED = "<redacted>"
+SENSITIVE_KEY_PATTERN = re.compile(
+    r"pass(word)?|secret|token|credential|private|api_?key|auth", re.IGNORECASE
+)
+# helm refuses list indexes above this, to avoid allocating huge lists
+MAX_INDEX = 65536
+
+# The plain scalars go-yaml v2 resolves by name
+PLAIN_NAMES = {
+    **dict.fromkeys(["", "~", "null", "Null", "NULL"], None),
+    **dict.fromkeys(
+        ["y", "Y", "yes", "Yes", "YES", "true", "True", "TRUE", "on", "On", "ON"],
+        True,
+    ),
+    **dict.fromkeys(
+        ["n", "N", "no", "No", "NO", "false", "False", "FALSE", "off", "Off", "OFF"],
+        False,
+    ),
+    **dict.fromkeys([".nan", ".NaN", ".NAN"], math.nan),
+    **dict.fromkeys([".inf", ".Inf", ".INF", "+.inf", "+.Inf", "+.INF"], math.inf),
+    **dict.fromkeys(["-.inf", "-.Inf", "-.INF"], -math.inf),
+}
+YAML_STYLE_FLOAT = re.compile(r"^[-+]?(\.[0-9]+|[0-9]+(\.[0-9]*)?)([eE][-+]?[0-9]+)?$")
+# The digits of an integer in each base, as Go's strconv.ParseInt takes them
+INT_PREFIXES = {"0x": 16, "0o": 8, "0b": 2}
+INT_DIGITS = {
+    16: re.compile(r"[0-9a-fA-F]+"),
+    10: re.compile(r"[0-9]+"),
+    8: re.compile(r"[0-7]+"),
+    2: re.compile(r"[01]+"),
+}
+
+
+class SetParseError(Exception):
+    def __init__(self, expression, reason, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expression = expression
+        self.reason = reason
+
+    def __str__(self):
+        return f"failed to parse --set {self.expression!r}: {self.reason}"
+
+
+class _HelmResolver(VersionedResolver):
+    def resolve(self, kind, value, implicit):
+        if kind is ScalarNode and implicit[0]:
+            return Tag(suffix=MERGE_TAG if value == "<<" else PLAIN_TAG)
+        return super().resolve(kind, value, implicit)
+
+
+class _HelmConstructor(SafeConstructor):
+    def construct_plain(self, node):
+        return _resolve_plain(node.value)
+
+    def construct_timestamp_text(self, node):
+        return node.value
+
+
+_HelmConstructor.add_constructor(PLAIN_TAG, _HelmConstructor.construct_plain)
+_HelmConstructor.add_constructor(
+    TIMESTAMP_TAG, _HelmConstructor.construct_timestamp_text
+)
+
+yaml = YAML(typ="safe", pure=True)
+yaml.Resolver = _HelmResolver
+yaml.Constructor = _HelmConstructor
+
+
+def _resolve_plain(value):
+    """
+    Returns the value of a plain scalar as go-yaml v2, which helm reads values
+    with, resolves it when decoding into an untyped value.
+    """
+    if value in PLAIN_NAMES:
+        return PLAIN_NAMES[value]
+    if value[0] in "+-0123456789":
+        # Timestamps are kept as text, which is what they already are here
+        plain = value.replace("_", "")
+        number = _parse_go_int(plain)
+        if number is not None:
+            return number
+        if YAML_STYLE_FLOAT.match(plain):
+            return float(plain)
+    elif value[0] == ".":
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _parse_go_int(value):
+    """
+    Returns value parsed like Go's strconv.ParseInt(value, 0, 64), falling
+    back to ParseUint, or None if neither accepts it.
+    """
+    sign, digits = 1, value
+    if digits[:1] in ("+", "-"):
+        sign, digits = (-1 if digits[0] == "-" else 1), digits[1:]
+    base = INT_PREFIXES.get(digits[:2].lower())
+    if base:
+        digits = digits[2:]
+    elif digits[:1] == "0" and len(digits) > 1:
+        base, digits = 8, digits[1:]
+    else:
+        base = 10
+    if not INT_DIGITS[base].fullmatch(digits):
+        return None
+    number = sign * int(digits, base)
+    if -(2**63) <= number < 2**63:
+        return number
+    # ParseUint takes no sign
+    if value[0] not in "+-" and number < 2**64:
+        return number
+    return None
+
+
+def _key_string(key):
+    """
+    Returns a map key as a string, as helm converts it when turning values
+    into JSON (sigs.k8s.io/yaml).
+    """
+    if isinstance(key, str):
+        return key
+    if isinstance(key, bool):
+        return "true" if key else "false"
+    if isinstance(key, int):
+        return str(key)
+    if isinstance(key, float):
+        return _format_go_float32(key)
+    if key is None:
+        return "null"
+    return str(key)
+
+
+def _format_go_float32(value):
+    """
+    Returns value formatted like Go's strconv.FormatFloat(value, 'g', -1, 32).
+    """
+    if math.isnan(value):
+        return ".nan"
+    if math.isinf(value):
+        return ".inf" if value > 0 else "-.inf"
+    if value == 0:
+        return "-0" if math.copysign(1, value) < 0 else "0"
+    single = struct.unpack("f", struct.pack("f", value))[0]
+    # The shortest decimal that reads back as the same 32-bit float
+    for precision in range(1, 10):
+        text = f"{single:.{precision}e}"
+        if struct.unpack("f", struct.pack("f", float(text)))[0] == single:
+            break
+    mantissa, exponent = text.split("e")
+    exponent = int(exponent)
+    digits = mantissa.replace("-", "").replace(".", "").rstrip("0") or "0"
+    sign = "-" if single < 0 else ""
+    # Go uses the exponent form from 1e+06 up for the shortest formatting
+    if exponent < -4 or exponent >= 6:
+        fraction = f".{digits[1:]}" if len(digits) > 1 else ""
+        return f"{sign}{digits[0]}{fraction}e{exponent:+03d}"
+    if exponent < 0:
+        return f"{sign}0.{'0' * (-exponent - 1)}{digits}"
+    whole = digits[: exponent + 1].ljust(exponent + 1, "0")
+    fraction = digits[exponent + 1 :]
+    return f"{sign}{whole}.{fraction}" if fraction else f"{sign}{whole}"
+
+
+def _string_keys(values):
+    if isinstance(values, dict):
+        return {_key_string(k): _string_keys(v) for k, v in values.items()}
+    if isinstance(values, list):
+        return [_string_keys(v) for v in values]
+    return values
+
+
+def load_values_file(path):
+    """
+    Returns the values in the YAML (or JSON) file at path, as a dict, read the
+    way helm reads values files.
+    """
+    with open(path) as f:
+        values = yaml.load(f)
+    return _string_keys(values or {})
+
+
+def merge_maps(base, override):
+    """
+    Returns base with override deep merged into it, as helm merges values
+    files. Neither argument is modified.
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_maps(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_values(values_files, set_values=None, set_string_values=None):
+    """
+    Returns the effective values of values_files and --set / --set-string
+    expressions, with helm's precedence.
+    """
+    values = {}
+    for path in values_files:
+        values = merge_maps(values, load_values_file(path))
+    for expression in set_values or []:
+        parse_set(expression, values)
+    for expression in set_string_values or []:
+        parse_set(expression, values, string=True)
+    return values
+
+
+def typed_value(value, string=False):
+    """
+    Returns the value of a --set (or with string, --set-string) expression with
+    helm's type inference.
+    """
+    if string:
+        return value
+    lowered = value.lower()
+    if lowered == "true":
+        return True
+    if lowered == "false":
+        return False
+    if lowered == "null":
+        return None
+    if value == "0":
+        return 0
+    # Like helm, values with a leading zero stay strings
+    if value and value[0] != "0" and re.fullmatch(r"[+-]?[0-9]+", value):
+        number = int(value)
+        if -(2**63) <= number < 2**63:
+            return number
+    return value
+
+
+def parse_set(expression, values, string=False):
+    """
+    Apply a --set (or with string, --set-string) expression to values in place.
+    """
+    parser = _SetParser(expression, string)
+    parser.parse_into(values)
+    return values
+
+
+class _SetParser:
+    """
+    A port of the relevant parts of helm's strvals parser.
+    """
+
+    def __init__(self, expression, string):
+        self.expression = expression
+        self.chars = list(expression)
+        self.pos = 0
+        self.string = string
+
+    def error(self, reason):
+        return SetParseError(self.expression, reason)
+
+    def read_until(self, stops):
+        """
+        Read up to (and consume) the first unescaped character in stops.
+        Returns the text read and the stop character, or None at the end.
+        """
+        out = []
+        while self.pos < len(self.chars):
+            c = self.chars[self.pos]
+            self.pos += 1
+            if c == "\\":
+                if self.pos < len(self.chars):
+                    out.append(self.chars[self.pos])
+                    self.pos += 1
+                continue
+            if c in stops:
+                return "".join(out), c
+            out.append(c)
+        return "".join(out), None
+
+    def parse_into(self, values):
+        while self.pos < len(self.chars):
+            self.key(values)
+
+    def key(self, data):
+        key, stop = self.read_until("=[,.")
+        if stop is None:
+            if key:
+                raise self.error(f"key {key!r} has no value")
+            return
+        if stop == "[":
+            if not key:
+                raise self.error("key is missing before [")
+            existing = data.get(key)
+            lst = existing if isinstance(existing, list) else []
+            data[key] = self.list_item(lst)
+            return
+        if stop == "=":
+            if self.peek() == "{":
+                self.pos += 1
+                data[key] = self.list_value()
+                self.consume_separator()
+            else:
+                value, _ = self.read_until(",")
+                data[key] = typed_value(value, self.string)
+            return
+        if stop == ",":
+            raise self.error(f"key {key!r} has no value (cannot end with ,)")
+        # stop == "."
+        if not key:
+            raise self.error("key is missing before .")
+        existing = data.get(key)
+        inner = existing if isinstance(existing, dict) else {}
+        data[key] = inner
+        self.key(inner)
+
+    def list_item(self, lst):
+        index_text, stop = self.read_until("]")
+        if stop is None:
+            raise self.error("unterminated list index")
+        try:
+            index = int(index_text)
+        except ValueError as e:
+            raise self.error(f"invalid list index {index_text!r}") from e
+        if index < 0 or index > MAX_INDEX:
+            raise self.error(f"list index {index} out of range")
+        lst = lst + [None] * (index + 1 - len(lst))
+
+        c = self.next()
+        if c == "=":
+            if self.peek() == "{":
+                self.pos += 1
+                lst[index] = self.list_value()
+                self.consume_separator()
+            else:
+                value, _ = self.read_until(",")
+                lst[index] = typed_value(value, self.string)
+        elif c == "[":
+            inner = lst[index] if isinstance(lst[index], list) else []
+            lst[index] = self.list_item(inner)
+        elif c == ".":
+            inner = lst[index] if isinstance(lst[index], dict) else {}
+            lst[index] = inner
+            self.key(inner)
+        else:
+            raise self.error(f"unexpected {c!r} after list index")
+        return lst
+
+    def list_value(self):
+        items = []
+        while True:
+            value, stop = self.read_until(",}")
+            if stop is None:
+                raise self.error("unterminated list value")
+            if value or stop == ",":
+                items.append(typed_value(value, self.string))
+            if stop == "}":
+                return items
+
+    def consume_separator(self):
+        c = self.next()
+        if c not in (None, ","):
+            raise self.error(f"unexpected {c!r} after list value")
+
+    def peek(self):
+        return self.chars[self.pos] if self.pos < len(self.chars) else None
+
+    def next(self):
+        c = self.peek()
+        if c is not None:
+            self.pos += 1
+        return c
+
+
+def canonical_document(values):
+    """
+    Returns values as a compact JSON document with sorted keys, which helm
+    reads as YAML. Equal values always give the same document.
+
+    NaN and infinite values cannot be written as JSON, so they raise a
+    ValueError.
+    """
+    return json.dumps(
+        values,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        allow_nan=False,
+    )
+
+
+def values_digest(values):
+    """
+    Returns a digest of the canonical document of values.
+    """
+    return hashlib.sha256(canonical_document(values).encode()).hexdigest()
+
+
+def redact(values, secret_values=None):
+    """
+    Returns a copy of values with sensitive entries replaced by REDACTED.
+
+    An entry is sensitive if its key looks like it holds a credential, or if it
+    is set by secret_values (the merged contents of the secret files).
+    """
+    redacted = {}
+    for key, value in values.items():
+        secret = secret_values.get(key) if isinstance(secret_values, dict) else None
+        if isinstance(value, dict):
+            redacted[key] = redact(value, secret)
+        elif key in (secret_values or {}) or SENSITIVE_KEY_PATTERN.search(str(key)):
+            redacted[key] = REDACTED
+        else:
+            redacted[key] = value
+    return redacted
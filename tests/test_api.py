@@ -0,0 +1,84 @@
+import subprocess
+
+import pytest
+
+from hubploy import api, helm
+
+
+@pytest.fixture
+def stub_deploy(monkeypatch):
+    """
+    Replace helm.deploy with a stub that fills in the report like a real
+    deploy and then raises error, if one is set.
+    """
+    calls = []
+    state = {"error": None}
+
+    def deploy(deployment, chart, environment, report=None, **kwargs):
+        calls.append((deployment, chart, environment, kwargs))
+        name = f"{deployment}-{environment}"
+        report.update(name=name, namespace=name, digest="abc123")
+        with helm.phase(report, "decrypt"):
+            pass
+        with helm.phase(report, "upgrade"):
+            report["output"] = "Release hub-staging has been upgraded\n"
+            if state["error"] is not None:
+                raise state["error"]
+        report["revision"] = 7
+
+    monkeypatch.setattr(helm, "deploy", deploy)
+    return calls, state
+
+
+def test_deploy_success(stub_deploy):
+    calls, state = stub_deploy
+    request = api.DeployRequest(
+        "hub", "chart", "staging", helm_config_overrides_implicit=["a=1"]
+    )
+    result = api.deploy(request)
+    assert result.status == api.STATUS_DEPLOYED
+    assert result.error is None
+    assert result.request is request
+    assert result.name == result.namespace == "hub-staging"
+    assert result.input_digest == "abc123"
+    assert result.revision == 7
+    assert set(result.phases) == {"decrypt", "upgrade"}
+    assert result.output == "Release hub-staging has been upgraded\n"
+    [(deployment, chart, environment, kwargs)] = calls
+    assert (deployment, chart, environment) == ("hub", "chart", "staging")
+    assert kwargs["helm_config_overrides_implicit"] == ["a=1"]
+
+
+def test_deploy_helm_failure(stub_deploy):
+    calls, state = stub_deploy
+    state["error"] = subprocess.CalledProcessError(1, ["helm", "upgrade"])
+    result = api.deploy(api.DeployRequest("hub", "chart", "staging"))
+    assert result.status == api.STATUS_FAILED
+    assert result.error == "helm exited with code 1"
+    assert result.revision is None
+    # The phase that failed is still timed, and its output kept
+    assert set(result.phases) == {"decrypt", "upgrade"}
+    assert result.output == "Release hub-staging has been upgraded\n"
+
+
+@pytest.mark.parametrize(
+    "error", [ValueError("bad config"), FileNotFoundError("hubploy.yaml")]
+)
+def test_deploy_never_raises(stub_deploy, error):
+    calls, state = stub_deploy
+    state["error"] = error
+    result = api.deploy(api.DeployRequest("hub", "chart", "staging"))
+    assert result.status == api.STATUS_FAILED
+    assert result.error == repr(error)
+
+
+def test_deploy_failure_before_report(monkeypatch):
+    def deploy(*args, **kwargs):
+        raise RuntimeError("no cluster")
+
+    monkeypatch.setattr(helm, "deploy", deploy)
+    result = api.deploy(api.DeployRequest("hub", "chart", "staging"))
+    assert result.status == api.STATUS_FAILED
+    assert result.name is None
+    assert result.phases == {}
+    assert result.output == ""
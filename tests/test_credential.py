@@ -0,0 +1,185 @@
+import base64
+import datetime
+import json
+import os
+import stat
+
+import boto3
+import pytest
+
+from hubploy import credential
+
+UTC = datetime.timezone.utc
+
+
+class StubCredentials:
+    """
+    Just enough of google.auth credentials to mint a token.
+    """
+
+    def __init__(self, expiry):
+        self.expiry_after_refresh = expiry
+        self.refreshes = 0
+        self.token = None
+        self.expiry = None
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f"token-{self.refreshes}"
+        self.expiry = self.expiry_after_refresh
+
+
+@pytest.fixture
+def google_default(monkeypatch):
+    def make(expiry):
+        credentials = StubCredentials(expiry)
+        requested_scopes = []
+
+        def default(scopes=None):
+            requested_scopes.append(scopes)
+            return credentials, "project"
+
+        monkeypatch.setattr(credential.google.auth, "default", default)
+        return credentials, requested_scopes
+
+    return make
+
+
+def in_minutes(minutes):
+    return datetime.datetime.now(UTC) + datetime.timedelta(minutes=minutes)
+
+
+def test_exec_user():
+    user = credential.exec_user(["gke"], "/tmp/cache")
+    assert user["exec"]["apiVersion"] == credential.EXEC_CREDENTIAL_API_VERSION
+    assert user["exec"]["args"] == [
+        "-m",
+        "hubploy.credential",
+        "gke",
+        "--cache-dir",
+        "/tmp/cache",
+    ]
+    assert user["exec"]["interactiveMode"] == "Never"
+
+
+def test_exec_credential():
+    expiry = datetime.datetime(2030, 1, 2, 3, 4, 5, 678, tzinfo=UTC)
+    assert credential.exec_credential("abc", expiry) == {
+        "apiVersion": "client.authentication.k8s.io/v1beta1",
+        "kind": "ExecCredential",
+        "status": {"token": "abc", "expirationTimestamp": "2030-01-02T03:04:05Z"},
+    }
+
+
+def test_exec_credential_converts_to_utc():
+    expiry = datetime.datetime(
+        2030, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=2))
+    )
+    document = credential.exec_credential("abc", expiry)
+    assert document["status"]["expirationTimestamp"] == "2030-01-02T01:04:05Z"
+
+
+def test_cache_round_trip(tmp_path):
+    entry = {"token": "abc", "expiry": credential._format_timestamp(in_minutes(60))}
+    credential.store_cached(str(tmp_path), "gke", entry)
+    assert credential.load_cached(str(tmp_path), "gke") == entry
+    mode = os.stat(tmp_path / "gke.json").st_mode
+    assert stat.S_IMODE(mode) == 0o600
+    assert [p.name for p in tmp_path.iterdir()] == ["gke.json"]
+
+
+def test_cache_expires_within_refresh_margin(tmp_path):
+    margin = credential.REFRESH_MARGIN.total_seconds() / 60
+    entry = {
+        "token": "abc",
+        "expiry": credential._format_timestamp(in_minutes(margin - 1)),
+    }
+    credential.store_cached(str(tmp_path), "gke", entry)
+    assert credential.load_cached(str(tmp_path), "gke") is None
+
+
+def test_cache_missing_or_corrupt(tmp_path):
+    assert credential.load_cached(str(tmp_path), "gke") is None
+    (tmp_path / "gke.json").write_text("{not json")
+    assert credential.load_cached(str(tmp_path), "gke") is None
+
+
+def test_gke_token_is_cached(tmp_path, google_default):
+    # google-auth reports a naive UTC expiry
+    credentials, scopes = google_default(in_minutes(60).replace(tzinfo=None))
+    token, expiry = credential.gke_token(str(tmp_path))
+    assert token == "token-1"
+    assert expiry.tzinfo is not None
+    assert scopes == [
+        [credential.CLOUD_PLATFORM_SCOPE, credential.USERINFO_EMAIL_SCOPE]
+    ]
+    assert credential.gke_token(str(tmp_path)) == (token, expiry)
+    assert credentials.refreshes == 1
+
+
+def test_gke_token_refreshed_near_expiry(tmp_path, google_default):
+    credentials, _ = google_default(in_minutes(2).replace(tzinfo=None))
+    credential.gke_token(str(tmp_path))
+    token, _ = credential.gke_token(str(tmp_path))
+    assert token == "token-2"
+    assert credentials.refreshes == 2
+
+
+def test_gke_token_without_expiry(tmp_path, google_default):
+    google_default(None)
+    token, expiry = credential.gke_token(str(tmp_path))
+    assert token == "token-1"
+    lifetime = expiry - datetime.datetime.now(UTC)
+    assert datetime.timedelta(0) < lifetime <= credential.UNKNOWN_TOKEN_LIFETIME
+
+
+def test_aws_role_session_is_cached(tmp_path, monkeypatch):
+    calls = []
+
+    class StubSTS:
+        def assume_role(self, RoleArn, RoleSessionName):
+            calls.append((RoleArn, RoleSessionName))
+            return {
+                "Credentials": {
+                    "AccessKeyId": "AKIDEXAMPLE",
+                    "SecretAccessKey": "secret",
+                    "SessionToken": "session",
+                    "Expiration": in_minutes(60),
+                }
+            }
+
+    monkeypatch.setattr(credential.boto3, "client", lambda service: StubSTS())
+    role = "arn:aws:iam::123456789012:role/deployer"
+    for _ in range(2):
+        session = credential.aws_role_session(role, "hubploy", str(tmp_path))
+        creds = session.get_credentials()
+        assert (creds.access_key, creds.secret_key, creds.token) == (
+            "AKIDEXAMPLE",
+            "secret",
+            "session",
+        )
+    assert calls == [(role, "hubploy")]
+
+
+def test_eks_token():
+    session = boto3.Session(
+        aws_access_key_id="AKIDEXAMPLE", aws_secret_access_key="secret"
+    )
+    token, expiry = credential.eks_token(session, "my-cluster", "us-west-2")
+    assert token.startswith(credential.EKS_TOKEN_PREFIX)
+    encoded = token[len(credential.EKS_TOKEN_PREFIX) :]
+    url = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode()
+    assert url.startswith("https://sts.us-west-2.amazonaws.com/")
+    assert "Action=GetCallerIdentity" in url
+    assert "X-Amz-Expires=60" in url
+    assert credential.EKS_CLUSTER_HEADER in url
+    lifetime = expiry - datetime.datetime.now(UTC)
+    assert lifetime <= credential.EKS_TOKEN_LIFETIME
+
+
+def test_main_prints_exec_credential(tmp_path, google_default, capsys):
+    google_default(in_minutes(60).replace(tzinfo=None))
+    credential.main(["gke", "--cache-dir", str(tmp_path)])
+    document = json.loads(capsys.readouterr().out)
+    assert document["kind"] == "ExecCredential"
+    assert document["status"]["token"] == "token-1"
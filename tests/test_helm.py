@@ -0,0 +1,138 @@
+import json
+import subprocess
+
+import pytest
+
+from hubploy import checkpoint, helm
+
+
+def helm_error(output):
+    return subprocess.CalledProcessError(1, [helm.HELM_EXECUTABLE, "upgrade"], output)
+
+
+@pytest.mark.parametrize(
+    "output, transient",
+    [
+        ("Error: UPGRADE FAILED: context deadline exceeded\n", True),
+        ("Error: Kubernetes cluster unreachable: dial tcp: i/o timeout\n", True),
+        ("Error: timed out waiting for the condition\n", True),
+        ("Error: the server is currently unable to handle the request\n", True),
+        (
+            "Error: UPGRADE FAILED: template: hub/templates/deployment.yaml:40: "
+            + "executing at <.Values.hub.readinessProbe.timeoutSeconds>: "
+            + "nil pointer evaluating interface {}.timeoutSeconds\n",
+            False,
+        ),
+        # A transient looking line that is not helm's final error
+        ("retrying after connection refused\nError: YAML parse error\n", False),
+        ("no error line, but it timed out\n", False),
+        ("", False),
+    ],
+)
+def test_is_transient_failure(output, transient):
+    assert helm.is_transient_failure(helm_error(output)) is transient
+
+
+def test_other_commands_are_not_transient():
+    e = subprocess.CalledProcessError(1, ["sops", "-d"], "Error: timed out\n")
+    assert not helm.is_transient_failure(e)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    state = checkpoint.load_checkpoint(path)
+    assert state == {"deployments": {}}
+    checkpoint.record_deployment(
+        path, state, "hub-prod", checkpoint.STATUS_DEPLOYED, "abc", 1
+    )
+    state = checkpoint.load_checkpoint(path)
+    assert checkpoint.is_deployed(state, "hub-prod", "abc")
+    assert not checkpoint.is_deployed(state, "hub-prod", "def")
+    assert not checkpoint.is_deployed(state, "other-prod", "abc")
+
+
+@pytest.fixture
+def stub_deploy(tmp_path, monkeypatch):
+    """
+    Replace helm.deploy with a stub that fails with the queued errors of a
+    deployment before succeeding, and record its calls.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(helm.time, "sleep", lambda seconds: None)
+    calls = []
+    errors = {}
+
+    def deploy(deployment, chart, environment, **kwargs):
+        calls.append(deployment)
+        queued = errors.get(deployment)
+        if queued:
+            raise queued.pop(0)
+
+    monkeypatch.setattr(helm, "deploy", deploy)
+    return calls, errors
+
+
+def test_deploy_many_skips_deployed_with_same_digest(tmp_path, stub_deploy):
+    calls, errors = stub_deploy
+    path = str(tmp_path / "checkpoint.json")
+    helm.deploy_many(["a", "b"], "chart", "prod", checkpoint_path=path)
+    assert calls == ["a", "b"]
+
+    helm.deploy_many(["a", "b"], "chart", "prod", checkpoint_path=path, resume=True)
+    assert calls == ["a", "b"]
+
+    # A changed input digest deploys again
+    helm.deploy_many(
+        ["a", "b"],
+        "chart",
+        "prod",
+        checkpoint_path=path,
+        resume=True,
+        helm_config_overrides_implicit=["x=1"],
+    )
+    assert calls == ["a", "b", "a", "b"]
+
+
+def test_deploy_many_retries_transient_failure(tmp_path, stub_deploy):
+    calls, errors = stub_deploy
+    errors["a"] = [helm_error("Error: UPGRADE FAILED: context deadline exceeded\n")]
+    path = str(tmp_path / "checkpoint.json")
+    helm.deploy_many(["a"], "chart", "prod", checkpoint_path=path, retries=2)
+    assert calls == ["a", "a"]
+    with open(path) as f:
+        entry = json.load(f)["deployments"]["a-prod"]
+    assert entry["status"] == checkpoint.STATUS_DEPLOYED
+    assert entry["attempts"] == 2
+
+
+def test_deploy_many_does_not_retry_permanent_failure(tmp_path, stub_deploy):
+    calls, errors = stub_deploy
+    error = helm_error("Error: UPGRADE FAILED: template: hub: timeoutSeconds\n")
+    errors["a"] = [error]
+    path = str(tmp_path / "checkpoint.json")
+    with pytest.raises(subprocess.CalledProcessError):
+        helm.deploy_many(["a", "b"], "chart", "prod", checkpoint_path=path, retries=3)
+    # The run stops at the failed deployment
+    assert calls == ["a"]
+    with open(path) as f:
+        entry = json.load(f)["deployments"]["a-prod"]
+    assert entry["status"] == checkpoint.STATUS_FAILED
+    assert entry["attempts"] == 1
+    assert "CalledProcessError" in entry["error"]
+
+
+def test_deploy_many_records_failure_after_retries(tmp_path, stub_deploy):
+    calls, errors = stub_deploy
+    errors["a"] = [helm_error("Error: timed out waiting for the condition\n")] * 3
+    path = str(tmp_path / "checkpoint.json")
+    with pytest.raises(subprocess.CalledProcessError):
+        helm.deploy_many(["a"], "chart", "prod", checkpoint_path=path, retries=1)
+    assert calls == ["a", "a"]
+    state = checkpoint.load_checkpoint(path)
+    assert state["deployments"]["a-prod"]["status"] == checkpoint.STATUS_FAILED
+    assert state["deployments"]["a-prod"]["attempts"] == 2
+
+
+def test_resume_requires_checkpoint():
+    with pytest.raises(ValueError):
+        helm.deploy_many(["a"], "chart", "prod", resume=True)
@@ -0,0 +1,90 @@
+import logging
+import os
+
+import pytest
+
+from hubploy import inventory
+from hubploy.config import DeploymentNotFoundError
+
+
+@pytest.fixture
+def deployments(tmp_path, monkeypatch):
+    def make(name, labels=""):
+        path = tmp_path / "deployments" / name
+        path.mkdir(parents=True)
+        config = "cluster:\n  provider: kubeconfig\n  kubeconfig:\n    context: ctx\n"
+        if labels:
+            config += "labels:\n" + labels
+        (path / "hubploy.yaml").write_text(config)
+        return path
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(inventory, "INVENTORY_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "deployments").mkdir()
+    return make
+
+
+def test_parse_selector():
+    assert inventory.parse_selector("a=1, b==2,c!=3,d,!e") == [
+        ("a", "=", "1"),
+        ("b", "=", "2"),
+        ("c", "!=", "3"),
+        ("d", "exists", None),
+        ("e", "!exists", None),
+    ]
+
+
+@pytest.mark.parametrize("selector", ["", "a,,b", "=1", "!"])
+def test_parse_selector_errors(selector):
+    with pytest.raises(inventory.SelectorParseError):
+        inventory.parse_selector(selector)
+
+
+def test_select_by_label_and_attribute(deployments):
+    deployments("a", "  tier: large\n")
+    deployments("b", "  tier: small\n")
+    deployments("c")
+    assert inventory.select("tier=large") == ["a"]
+    assert inventory.select("tier!=large") == ["b", "c"]
+    assert inventory.select("!tier,provider=kubeconfig") == ["c"]
+    assert inventory.select("cluster=ctx", ["b", "c"]) == ["b", "c"]
+
+
+def test_boolean_labels_are_lowercase(deployments):
+    deployments("a", "  gpu: true\n  preview: false\n")
+    entry = inventory.load_inventory()["a"]
+    assert entry["labels"] == {"gpu": "true", "preview": "false"}
+    assert inventory.select("gpu=true") == ["a"]
+
+
+def test_unknown_deployment_raises(deployments):
+    deployments("a")
+    with pytest.raises(DeploymentNotFoundError):
+        inventory.select("provider=kubeconfig", ["a", "missing"])
+
+
+def test_directory_without_config_is_skipped(deployments, caplog):
+    deployments("a")
+    (deployments("b") / "hubploy.yaml").unlink()
+    with caplog.at_level(logging.WARNING):
+        assert list(inventory.load_inventory()) == ["a"]
+    assert "has no hubploy.yaml" in caplog.text
+
+
+def test_cache_is_rebuilt_when_config_changes(deployments):
+    path = deployments("a", "  tier: small\n")
+    assert inventory.select("tier=small") == ["a"]
+    config = path / "hubploy.yaml"
+    config.write_text(config.read_text().replace("small", "large"))
+    # Make sure the mtime moves even on coarse grained filesystems
+    stat = config.stat()
+    os.utime(config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert inventory.select("tier=large") == ["a"]
+
+
+def test_cache_is_outside_the_repository(deployments, tmp_path):
+    deployments("a")
+    inventory.load_inventory()
+    [cached] = (tmp_path / "cache").iterdir()
+    assert cached.name == os.path.basename(inventory.inventory_path())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cache", "deployments"]
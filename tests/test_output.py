@@ -0,0 +1,74 @@
+import sys
+
+import pytest
+
+from hubploy import output
+
+
+def test_secret_strings():
+    secrets = output.secret_strings(
+        {"a": "hunter22", "b": [123456, "abc"], "c": {"d": 1.25, "e": True}, "f": None}
+    )
+    assert secrets == {"hunter22", "123456", "1.25"}
+
+
+def run(helm_output, text):
+    script = f"import sys; sys.stdout.write({text!r})"
+    helm_output.run([sys.executable, "-c", script])
+    return helm_output.tail()
+
+
+def test_redacts_secrets_and_patterns():
+    helm_output = output.HelmOutput("hub", echo=False, secrets={"hunter22"})
+    tail = run(helm_output, "login hunter22\nAuthorization: Bearer abc.def\n")
+    assert tail == "login <redacted>\nAuthorization: Bearer <redacted>\n"
+
+
+@pytest.mark.parametrize("offset", range(0, 12))
+def test_secret_across_split_line_is_redacted(monkeypatch, offset):
+    monkeypatch.setattr(output, "MAX_LINE_LENGTH", 16)
+    # Hold back only what the secret needs
+    monkeypatch.setattr(output, "PATTERN_OVERLAP", 0)
+    helm_output = output.HelmOutput("hub", echo=False, secrets={"hunter22secret"})
+    line = "x" * offset + "hunter22secret" + "y" * 40 + "\n"
+    tail = run(helm_output, line)
+    assert "hunter22" not in tail
+    assert "secret" not in tail
+    assert tail.replace("\n", "") == "x" * offset + "<redacted>" + "y" * 40
+
+
+@pytest.mark.parametrize("offset", range(0, 20))
+def test_pattern_across_split_line_is_redacted(monkeypatch, offset):
+    monkeypatch.setattr(output, "MAX_LINE_LENGTH", 16)
+    helm_output = output.HelmOutput("hub", echo=False)
+    value = "S3CRETVALUE" * 8
+    tail = run(helm_output, "x" * offset + " password: " + value + "\nnext line\n")
+    assert "S3CRET" not in tail
+    assert "VALUE" not in tail
+    assert tail.endswith("password: <redacted>\nnext line\n")
+
+
+def test_command_line_is_redacted_in_log(tmp_path):
+    helm_output = output.HelmOutput("hub", echo=False, log_dir=str(tmp_path))
+    with helm_output:
+        helm_output.run([sys.executable, "-c", "pass", "--set", "hub.token=abcd1234"])
+    with output.gzip.open(tmp_path / "hub.log.gz", "rt") as f:
+        log = f.read()
+    assert "abcd1234" not in log
+    assert "hub.token=<redacted>" in log
+
+
+def test_split_line_without_trailing_newline(monkeypatch):
+    monkeypatch.setattr(output, "MAX_LINE_LENGTH", 8)
+    monkeypatch.setattr(output, "PATTERN_OVERLAP", 0)
+    helm_output = output.HelmOutput("hub", echo=False)
+    assert run(helm_output, "a" * 20) == "aaaaaaaa\naaaaaaaa\naaaa\n"
+
+
+def test_failure_raises_with_tail():
+    helm_output = output.HelmOutput("hub", echo=False, secrets={"hunter22"})
+    script = "import sys; print('bad hunter22'); sys.exit(3)"
+    with pytest.raises(output.subprocess.CalledProcessError) as e:
+        helm_output.run([sys.executable, "-c", script])
+    assert e.value.returncode == 3
+    assert e.value.output == "bad <redacted>\n"
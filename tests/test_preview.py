@@ -0,0 +1,105 @@
+import pytest
+
+from hubploy import helm, preview
+
+DEVELOP_CONFIG = """\
+ingress:
+  enabled: true
+  hosts:
+    - develop.example.org
+proxy:
+  service:
+    loadBalancerIP: 10.0.0.1
+"""
+
+
+@pytest.fixture
+def deployment(tmp_path, monkeypatch):
+    def make(develop_config=DEVELOP_CONFIG, preview_config=""):
+        path = tmp_path / "deployments" / "hub"
+        (path / "config").mkdir(parents=True)
+        (path / "hubploy.yaml").write_text(
+            "cluster:\n  provider: kubeconfig\n" + preview_config
+        )
+        (path / "config" / "develop.yaml").write_text(develop_config)
+        return "hub"
+
+    monkeypatch.chdir(tmp_path)
+    return make
+
+
+@pytest.fixture
+def deploys(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        helm, "deploy", lambda *args, **kwargs: calls.append((args, kwargs))
+    )
+    return calls
+
+
+@pytest.mark.parametrize("pr", ["12a", "", "1;rm", "-1", "1 2", "¹"])
+def test_pr_must_be_numeric(pr):
+    with pytest.raises(ValueError):
+        preview.preview_name("hub", pr)
+
+
+def test_preview_name():
+    assert preview.preview_name("hub", "42") == "hub-pr-42"
+    assert preview.preview_name("hub", 42) == "hub-pr-42"
+
+
+def test_preview_overrides():
+    config = {
+        "preview": {
+            "set": ["ingress.hosts[0]=pr-{pr}.example.org"],
+            "set_string": ["hub.name={name}"],
+        }
+    }
+    assert preview.preview_overrides(config, "hub", "7") == (
+        ["ingress.hosts[0]=pr-7.example.org"],
+        ["hub.name=hub-pr-7"],
+    )
+    assert preview.preview_overrides({}, "hub", "7") == ([], [])
+
+
+def test_up_refuses_to_reuse_develop_hosts(deployment, deploys):
+    deployment()
+    with pytest.raises(preview.PreviewConflictError) as e:
+        preview.up("hub", "chart", "7")
+    assert e.value.conflicts == ["ingress.hosts", "proxy.service.loadBalancerIP"]
+    assert deploys == []
+
+
+def test_up_with_wrapper_chart_values(deployment, deploys):
+    wrapped = "".join("  " + line for line in DEVELOP_CONFIG.splitlines(True))
+    deployment(develop_config="jupyterhub:\n" + wrapped)
+    with pytest.raises(preview.PreviewConflictError) as e:
+        preview.up("hub", "chart", "7")
+    assert e.value.conflicts == [
+        "jupyterhub.ingress.hosts",
+        "jupyterhub.proxy.service.loadBalancerIP",
+    ]
+
+
+def test_up_applies_preview_overrides(deployment, deploys):
+    deployment(
+        preview_config="preview:\n  set:\n"
+        + "    - ingress.hosts[0]=pr-{pr}.example.org\n"
+        + "    - proxy.service.loadBalancerIP=null\n"
+    )
+    preview.up("hub", "chart", "7", helm_config_overrides_implicit=["a=1"])
+    [(args, kwargs)] = deploys
+    assert args == ("hub", "chart", preview.PREVIEW_ENVIRONMENT)
+    assert kwargs["name"] == "hub-pr-7"
+    assert kwargs["helm_config_overrides_implicit"] == [
+        "ingress.hosts[0]=pr-7.example.org",
+        "proxy.service.loadBalancerIP=null",
+        "a=1",
+    ]
+    assert kwargs["namespace_labels"][preview.PR_LABEL] == "7"
+
+
+def test_up_without_exclusive_values(deployment, deploys):
+    deployment(develop_config="hub:\n  image:\n    tag: '1.0'\n")
+    preview.up("hub", "chart", "7")
+    assert len(deploys) == 1
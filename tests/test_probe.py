@@ -0,0 +1,129 @@
+import http.server
+import socket
+import threading
+import time
+
+import pytest
+
+from hubploy import probe
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(0.2)
+        self.send_response(500 if self.path == "/error" else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def closed_url():
+    # A port nothing listens on
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert probe.percentile(values, 50) == 50
+    assert probe.percentile(values, 95) == 95
+    assert probe.percentile([3, 1, 2], 0) == 1
+    assert probe.percentile([7], 95) == 7
+    assert probe.percentile([], 50) is None
+
+
+def test_healthy_target_passes(server_url):
+    config = {
+        "requests": 5,
+        "p95_ms": 5000,
+        "max_error_rate": 0,
+        "targets": [{"name": "ok", "url": server_url + "/ok"}],
+    }
+    [result] = probe.verify_deployment(config, {})
+    assert result["errors"] == 0
+    assert result["p50_ms"] is not None
+
+
+def test_latency_threshold_exceeded(server_url):
+    config = {
+        "requests": 3,
+        "targets": [{"name": "slow", "url": server_url + "/slow", "p50_ms": 100}],
+    }
+    with pytest.raises(probe.ProbeFailedError) as e:
+        probe.verify_deployment(config, {})
+    assert e.value.failures[0].startswith("slow p50_ms")
+
+
+def test_error_rate_threshold_exceeded(server_url):
+    config = {
+        "requests": 4,
+        "max_error_rate": 0.5,
+        "targets": [{"name": "error", "url": server_url + "/error"}],
+    }
+    with pytest.raises(probe.ProbeFailedError) as e:
+        probe.verify_deployment(config, {})
+    assert e.value.failures == ["error max_error_rate 1 > 0.5"]
+
+
+def test_expected_status(server_url):
+    config = {
+        "requests": 2,
+        "max_error_rate": 0,
+        "targets": [
+            {"name": "error", "url": server_url + "/error", "expected_status": 500}
+        ],
+    }
+    [result] = probe.verify_deployment(config, {})
+    assert result["error_rate"] == 0
+
+
+def test_all_requests_failing_fails_latency_threshold(closed_url):
+    # Only a latency threshold is set: no successful request must not pass it
+    config = {
+        "requests": 2,
+        "timeout": 1,
+        "targets": [{"name": "down", "url": closed_url, "p95_ms": 1000}],
+    }
+    with pytest.raises(probe.ProbeFailedError) as e:
+        probe.verify_deployment(config, {})
+    assert e.value.failures == ["down p95_ms has no successful requests"]
+
+
+def test_url_template(server_url):
+    config = {
+        "requests": 1,
+        "targets": [{"name": "ok", "url": server_url + "/{name}"}],
+    }
+    [result] = probe.run_probes(config, {"name": "ok"})
+    assert result["url"] == server_url + "/ok"
+
+
+def test_concurrency_is_not_capped_by_default_executor(server_url):
+    # Every /slow request takes 0.2s; with 40 in flight they finish together
+    # rather than in batches of the default executor's size
+    config = {
+        "requests": 40,
+        "concurrency": 40,
+        "timeout": 5,
+        "targets": [{"name": "slow", "url": server_url + "/slow"}],
+    }
+    start = time.perf_counter()
+    [result] = probe.run_probes(config, {})
+    assert result["errors"] == 0
+    assert time.perf_counter() - start < 1.5
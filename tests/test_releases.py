@@ -0,0 +1,121 @@
+import pytest
+
+from types import SimpleNamespace
+
+from hubploy import releases
+
+
+class StubCoreV1Api:
+    """
+    Just enough of CoreV1Api to list and delete helm release secrets.
+    """
+
+    def __init__(self, revisions, deployed):
+        self.secrets = {
+            f"sh.helm.release.v1.hub-prod.v{v}": SimpleNamespace(
+                metadata=SimpleNamespace(
+                    name=f"sh.helm.release.v1.hub-prod.v{v}",
+                    labels={
+                        "owner": "helm",
+                        "name": "hub-prod",
+                        "version": str(v),
+                        "status": "deployed" if v == deployed else "superseded",
+                    },
+                ),
+                data={"release": "x" * 100},
+            )
+            for v in revisions
+        }
+        self.deleted = []
+
+    def list_namespaced_secret(self, namespace, label_selector):
+        assert label_selector == "owner=helm,name=hub-prod"
+        return SimpleNamespace(items=list(self.secrets.values()))
+
+    def delete_namespaced_secret(self, name, namespace):
+        self.deleted.append(name)
+        del self.secrets[name]
+
+
+@pytest.fixture
+def deployment(tmp_path, monkeypatch):
+    def make(history_max=None):
+        path = tmp_path / "deployments" / "hub"
+        path.mkdir(parents=True, exist_ok=True)
+        config = "cluster:\n  provider: kubeconfig\n"
+        if history_max is not None:
+            config += f"helm:\n  history_max: {history_max}\n"
+        (path / "hubploy.yaml").write_text(config)
+        return "hub"
+
+    monkeypatch.chdir(tmp_path)
+    return make
+
+
+def versions(names):
+    return sorted(int(n.rsplit(".v", 1)[1]) for n in names)
+
+
+def test_report(deployment):
+    api = StubCoreV1Api(range(1, 6), deployed=5)
+    report = releases.releases(deployment(), "prod", "report", api=api)
+    assert report["revisions"] == 5
+    assert report["bytes"] == 500
+    assert report["pruned"] == 0
+    assert api.deleted == []
+
+
+def test_prune_keeps_newest(deployment):
+    api = StubCoreV1Api(range(1, 13), deployed=12)
+    report = releases.releases(deployment(), "prod", "prune", keep=3, api=api)
+    assert versions(api.deleted) == list(range(1, 10))
+    assert report["revisions"] == 3
+    assert report["pruned"] == 9
+
+
+def test_prune_never_deletes_deployed_revision(deployment):
+    # After a failed upgrade the deployed revision is not the newest
+    api = StubCoreV1Api(range(1, 8), deployed=2)
+    releases.releases(deployment(), "prod", "prune", keep=2, api=api)
+    assert versions(api.deleted) == [1, 3, 4, 5]
+    assert versions(api.secrets) == [2, 6, 7]
+
+
+def test_prune_dry_run(deployment):
+    api = StubCoreV1Api(range(1, 6), deployed=5)
+    report = releases.releases(
+        deployment(), "prod", "prune", keep=2, dry_run=True, api=api
+    )
+    assert api.deleted == []
+    assert report["revisions"] == 5
+    assert report["pruned"] == 3
+
+
+def test_prune_defaults_to_history_max(deployment):
+    api = StubCoreV1Api(range(1, 8), deployed=7)
+    releases.releases(deployment(history_max=4), "prod", "prune", api=api)
+    assert versions(api.secrets) == [4, 5, 6, 7]
+
+
+def test_prune_defaults_to_helm_default(deployment):
+    api = StubCoreV1Api(range(1, 16), deployed=15)
+    releases.releases(deployment(), "prod", "prune", api=api)
+    assert len(api.secrets) == releases.DEFAULT_KEEP
+
+
+def test_unlimited_history_is_not_pruned(deployment):
+    # history_max: 0 is unlimited for helm, not "use the default"
+    api = StubCoreV1Api(range(1, 16), deployed=15)
+    report = releases.releases(deployment(history_max=0), "prod", "prune", api=api)
+    assert api.deleted == []
+    assert report["pruned"] == 0
+
+
+@pytest.mark.parametrize("keep, history_max", [(-1, None), (None, -3)])
+def test_negative_keep_is_rejected(deployment, keep, history_max):
+    api = StubCoreV1Api(range(1, 6), deployed=5)
+    with pytest.raises(ValueError):
+        releases.releases(
+            deployment(history_max=history_max), "prod", "prune", keep=keep, api=api
+        )
+    assert api.deleted == []
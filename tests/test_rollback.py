@@ -0,0 +1,38 @@
+import pytest
+
+from hubploy import rollback
+from hubploy.helm import DESCRIPTION_DIGEST_PREFIX
+
+
+def revision(number, digest=None):
+    description = DESCRIPTION_DIGEST_PREFIX + digest if digest else "Upgrade complete"
+    return {"revision": number, "description": description}
+
+
+HISTORY = [
+    revision(1, "aaaa1111"),
+    revision(2, "bbbb2222"),
+    revision(3),
+    revision(4, "aaaa1111"),
+    revision(5, "aaab3333"),
+]
+
+
+def test_full_digest_returns_newest_revision():
+    assert rollback.find_revision(HISTORY, "hub-prod", "aaaa1111") == 4
+
+
+def test_unique_prefix():
+    assert rollback.find_revision(HISTORY, "hub-prod", "bb") == 2
+    assert rollback.find_revision(HISTORY, "hub-prod", "aaaa") == 4
+
+
+def test_ambiguous_prefix_raises():
+    with pytest.raises(rollback.AmbiguousDigestError) as e:
+        rollback.find_revision(HISTORY, "hub-prod", "aaa")
+    assert e.value.matches == ["aaaa1111", "aaab3333"]
+
+
+def test_unknown_digest_raises():
+    with pytest.raises(rollback.RevisionNotFoundError):
+        rollback.find_revision(HISTORY, "hub-prod", "cccc")
@@ -0,0 +1,221 @@
+import shutil
+import subprocess
+
+import pytest
+
+from hubploy import values
+
+CHART_YAML = """\
+apiVersion: v2
+name: parity
+version: 0.1.0
+"""
+CHART_VALUES = """\
+image:
+  name: jupyterhub/k8s-hub
+  tag: "1.0"
+  pullPolicy: IfNotPresent
+removed:
+  by: null
+hub:
+  extraEnv:
+    A: "1"
+"""
+TEMPLATE = """\
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: values
+data:
+  values.json: {{ toJson .Values | quote }}
+"""
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def values_file(tmp_path):
+    def make(text, name="values.yaml"):
+        return write(tmp_path / name, text)
+
+    return make
+
+
+def test_yaml_11_boolean_keys_become_strings(values_file):
+    path = values_file("on: 1\nOFF: 2\nnot-bool: 3\n")
+    loaded = values.load_values_file(path)
+    assert loaded == {"true": 1, "false": 2, "not-bool": 3}
+    # and can be written as a canonical document
+    assert values.canonical_document(loaded) == '{"false":2,"not-bool":3,"true":1}'
+
+
+def test_no_and_numeric_keys(values_file):
+    path = values_file("no: a\n1.5: b\n2: c\n1000000.0: d\n")
+    assert values.load_values_file(path) == {
+        "false": "a",
+        "1.5": "b",
+        "2": "c",
+        "1e+06": "d",
+    }
+
+
+def test_timestamps_keep_their_text(values_file):
+    path = values_file(
+        "when: 2020-01-01 10:00:00\nday: 2020-01-01\nat: 2001-12-14t21:59:43.10-05:00\n"
+    )
+    assert values.load_values_file(path) == {
+        "when": "2020-01-01 10:00:00",
+        "day": "2020-01-01",
+        "at": "2001-12-14t21:59:43.10-05:00",
+    }
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("yes", True),
+        ("Off", False),
+        ("y", True),
+        ("'yes'", "yes"),
+        ("!!str on", "on"),
+        ("~", None),
+        ("", None),
+        ("0123", 83),
+        ("0x1F", 31),
+        ("1_000", 1000),
+        ("08", 8.0),
+        ("1.0", 1.0),
+        ("1e3", 1000.0),
+        (".5", 0.5),
+        ("1:20", "1:20"),
+        ("-x", "-x"),
+        ("18446744073709551615", 18446744073709551615),
+        ("1.2.3", "1.2.3"),
+    ],
+)
+def test_plain_scalars_resolve_like_helm(values_file, text, expected):
+    path = values_file(f"value: {text}\n")
+    assert values.load_values_file(path)["value"] == expected
+
+
+def test_merge_keys(values_file):
+    path = values_file("base: &b {x: 1, z: 2}\nmerged:\n  <<: *b\n  z: 3\n")
+    assert values.load_values_file(path)["merged"] == {"x": 1, "z": 3}
+
+
+def test_merge_precedence_and_null(values_file):
+    first = values_file("a: {b: 1, c: [1, 2]}\nd: keep\n", "first.yaml")
+    second = values_file("a: {c: [3], e: null}\n", "second.yaml")
+    merged = values.merge_values([first, second], ["a.b=2,f=true"], ["a.g=true,d=007"])
+    assert merged == {
+        "a": {"b": 2, "c": [3], "e": None, "g": "true"},
+        "d": "007",
+        "f": True,
+    }
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        (
+            "a=1,b=true,c=null,d=007,e=0",
+            {"a": 1, "b": True, "c": None, "d": "007", "e": 0},
+        ),
+        ("a.b.c=x", {"a": {"b": {"c": "x"}}}),
+        ("list[2]=x", {"list": [None, None, "x"]}),
+        ("list[0].name=x", {"list": [{"name": "x"}]}),
+        ("a={x,y,3}", {"a": ["x", "y", 3]}),
+        ("a={}", {"a": []}),
+        (r"a=x\,y", {"a": "x,y"}),
+        (r"a\.b=x", {"a.b": "x"}),
+        ("a=", {"a": ""}),
+        ("a=9223372036854775808", {"a": "9223372036854775808"}),
+    ],
+)
+def test_parse_set(expression, expected):
+    assert values.parse_set(expression, {}) == expected
+
+
+@pytest.mark.parametrize("expression", ["a", "a,b=1", "a[x]=1", "a[1", "a={x"])
+def test_parse_set_errors(expression):
+    with pytest.raises(values.SetParseError):
+        values.parse_set(expression, {})
+
+
+def test_canonical_document_is_stable():
+    one = values.canonical_document({"b": 1, "a": {"d": [1, "x"], "c": None}})
+    two = values.canonical_document({"a": {"c": None, "d": [1, "x"]}, "b": 1})
+    assert one == two == '{"a":{"c":null,"d":[1,"x"]},"b":1}'
+
+
+def test_redact():
+    redacted = values.redact(
+        {"hub": {"cookieSecret": "x", "name": "y", "db": {"url": "z"}}},
+        {"hub": {"db": {"url": "z"}}},
+    )
+    assert redacted == {
+        "hub": {
+            "cookieSecret": values.REDACTED,
+            "name": "y",
+            "db": {"url": values.REDACTED},
+        }
+    }
+
+
+PARITY_CASES = [
+    (
+        ["on: true\nno: 1\nwhen: 2020-01-01 10:00:00\n", "oct: 0123\nflt: 1.50\n"],
+        [],
+        [],
+    ),
+    (
+        [
+            "image:\n  tag: '2.0'\nremoved: null\nhub:\n  extraEnv:\n    B: '2'\n",
+            "hub:\n  extraEnv: {A: null}\nlist: [1, 2]\n",
+        ],
+        ["list[3]=x,image.pullPolicy=Always", r"a\.b=c\,d,x={1,two}"],
+        ["hub.extraEnv.C=true,n=007"],
+    ),
+    (
+        ["no: off\ny: n\n1.5: f\nsexa: 1:20\nhex: 0x1F\nbig: 1_000_000\n"],
+        ["nested.key=null,zero=0,neg=-1"],
+        [],
+    ),
+]
+
+
+@pytest.mark.skipif(shutil.which("helm") is None, reason="helm is not installed")
+@pytest.mark.parametrize("files, set_values, set_string_values", PARITY_CASES)
+def test_parity_with_helm_template(tmp_path, files, set_values, set_string_values):
+    """
+    Rendering with helm's own -f/--set handling and with the merged document
+    on stdin must give the same manifests.
+    """
+    chart = tmp_path / "chart"
+    (chart / "templates").mkdir(parents=True)
+    write(chart / "Chart.yaml", CHART_YAML)
+    write(chart / "values.yaml", CHART_VALUES)
+    write(chart / "templates" / "values.yaml", TEMPLATE)
+    paths = [write(tmp_path / f"values-{i}.yaml", f) for i, f in enumerate(files)]
+
+    cmd = ["helm", "template", "parity", str(chart)]
+    flags = [arg for path in paths for arg in ("-f", path)]
+    flags += [arg for expression in set_values for arg in ("--set", expression)]
+    flags += [
+        arg for expression in set_string_values for arg in ("--set-string", expression)
+    ]
+    expected = subprocess.run(
+        cmd + flags, check=True, capture_output=True, text=True
+    ).stdout
+
+    document = values.canonical_document(
+        values.merge_values(paths, set_values, set_string_values)
+    )
+    actual = subprocess.run(
+        cmd + ["-f", "-"], input=document, check=True, capture_output=True, text=True
+    ).stdout
+
+    assert actual == expected